@@ -0,0 +1,10 @@
+# rcmp benchmark launcher.
+#
+# Usage python3 bench.py [--seconds n] [--files n] [--output file]
+#
+
+import sys
+
+if __name__ == "__main__":
+    from rcmp.bench import main
+    sys.exit(main(sys.argv))
@@ -6,8 +6,7 @@
 import sys
 
 if __name__ == "__main__":
-    from rcmp.rcmp import Rcmp
-    Rcmp.run(sys.argv)
-    sys.exit(0)
+    from rcmp.startup import main
+    sys.exit(main(sys.argv))
 
     
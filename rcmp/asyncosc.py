@@ -0,0 +1,163 @@
+# rcmp.asyncosc
+#
+# Defines AsyncOSCServer class.
+#
+# An asyncio datagram OSC server which replaces the pyOSC3 polling server.
+# Datagrams are read by the event loop as they arrive, OSC bundles are
+# unpacked and each contained message is dispatched in order.  pyOSC3 is
+# still used to decode and encode OSC packets.
+#
+# Callbacks are registered with addMsgHandler() and called with the same
+# arguments as pyOSC3.OSCServer callbacks:  (address, typetags, data, client)
+#
+
+import asyncio
+import socket
+import struct
+import pyOSC3
+import rcmp.log
+
+
+class _Protocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, client_address):
+        self.server.dispatch(data, client_address)
+
+    def error_received(self, exc):
+        rcmp.log.error(f"OSC socket error: {exc}")
+
+
+class AsyncOSCServer:
+
+    """OSC server running on an asyncio event loop."""
+
+    def __init__(self, server_address):
+        """
+        Constructs new instance of AsyncOSCServer.
+
+        The socket is bound immediately, so an unusable address raises OSError
+        here rather than when the server is started.
+
+            Parameters:
+                server_address (tuple): (ip, port)
+        """
+        self.address = server_address
+        self.callbacks = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(server_address)
+        self._loop = None
+        self._transport = None
+        self._closed = None
+        self._close_requested = False
+        self.received = 0     # datagram count
+        self.dispatched = 0   # message count, bundles are counted per message.
+
+    def addMsgHandler(self, address, callback):
+        """
+        Registers callback for an OSC address.
+        """
+        if address != "default":
+            address = "/" + address.strip("/")
+        self.callbacks[address] = callback
+
+    def serve_forever(self):
+        """
+        Runs the event loop in the calling thread until close() is called.
+        """
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._closed = self._loop.create_future()
+        if self._close_requested:
+            self._socket.close()
+            return
+        self._transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _Protocol(self), sock=self._socket)
+        try:
+            await self._closed
+        finally:
+            self._transport.close()
+
+    def dispatch(self, data, client_address):
+        """
+        Decodes an OSC packet and calls the matching callbacks.
+        """
+        self.received += 1
+        try:
+            decoded = pyOSC3.decodeOSC(data)
+        except (pyOSC3.OSCError, ValueError, IndexError, struct.error) as err:
+            rcmp.log.error(f"Malformed OSC packet from {client_address}: {err}")
+            return
+        self._dispatch_decoded(decoded, client_address)
+
+    def _dispatch_decoded(self, decoded, client_address):
+        if not decoded:
+            return
+        if decoded[0] == "#bundle":
+            # Bundle time tags are not scheduled, contents are dispatched
+            # immediately in order, as pyOSC3 does.
+            for element in decoded[2:]:
+                self._dispatch_decoded(element, client_address)
+            return
+        address, tags, data = decoded[0], decoded[1][1:], decoded[2:]
+        callback = self.callbacks.get(address) or self.callbacks.get("default")
+        if callback is None:
+            rcmp.log.warning(f"Unknown OSC address: {address}")
+            return
+        self.dispatched += 1
+        try:
+            callback(address, tags, data, client_address)
+        except Exception as err:
+            # A faulty message must not stop the server.
+            rcmp.log.error(f"OSC {address} {data}: {err!r}")
+
+    def sendto(self, msg, client_address):
+        """
+        Sends OSCMessage or OSCBundle to client_address.
+
+        May be called from any thread.
+        """
+        if self._loop and self._transport:
+            data = msg.getBinary()
+            self._loop.call_soon_threadsafe(self._transport.sendto, data, client_address)
+
+    def call_soon(self, function, *args):
+        """
+        Runs function(*args) on the server's thread, in order with OSC
+        callbacks.  If the server is not running it is called immediately.
+
+        May be called from any thread.
+        """
+        loop = self._loop
+        if loop and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(function, *args)
+                return
+            except RuntimeError:   # loop already stopped
+                pass
+        function(*args)
+
+    def close(self):
+        """
+        Stops the server, may be called from any thread.
+        """
+        self._close_requested = True
+        loop = self._loop
+        if loop and self._closed:
+            try:
+                loop.call_soon_threadsafe(self._set_closed)
+            except RuntimeError:   # loop already stopped
+                pass
+        else:
+            self._socket.close()
+
+    def _set_closed(self):
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def __str__(self):
+        return f"AsyncOSCServer {self.address[0]}:{self.address[1]}"
@@ -0,0 +1,287 @@
+# rcmp.bench
+#
+# Timing and throughput benchmarks which run without MIDI hardware.
+#
+# Synthetic MIDI files are written to a temporary directory and played to a
+# RecordingPort, an in-process stand-in for a mido output port which
+# timestamps every send().  Results are printed as JSON so that runs can be
+# compared over time.
+#
+# Usage:  python3 bench.py [--seconds n] [--files n] [--output file]
+#
+
+import argparse
+import json
+import os.path
+import platform
+import statistics
+import tempfile
+import time
+import mido
+import rcmp.fanout
+import rcmp.index
+import rcmp.media
+import rcmp.panic
+import rcmp.precision
+import rcmp.rcmp
+import rcmp.timeline
+
+
+TICKS_PER_BEAT = 480
+
+
+class RecordingPort:
+
+    """
+    mido output port stand-in which records (clock, message) for each send.
+    Raw bytes sent with send_raw() are recorded as they are.
+    """
+
+    def __init__(self, name="recording", clock=time.perf_counter):
+        self.name = name
+        self.clock = clock
+        self.sent = []
+        self.closed = False
+
+    def send(self, msg):
+        self.sent.append((self.clock(), msg))
+
+    def send_raw(self, data):
+        self.sent.append((self.clock(), data))
+
+    def reset(self):
+        self.sent = []
+
+    def close(self):
+        self.closed = True
+
+
+def _ticks(seconds, bpm=120):
+    return int(seconds * bpm / 60 * TICKS_PER_BEAT)
+
+
+def _dense(seconds, rate):
+    # Single track of overlapping notes, rate note_on per second.
+    track = mido.MidiTrack()
+    step = max(1, _ticks(1.0 / rate))
+    for i in range(int(seconds * rate)):
+        channel = i % 16
+        key = 36 + (i * 7) % 60
+        track.append(mido.Message("note_on", channel=channel, note=key, velocity=90,
+                                  time=0 if i == 0 else step // 2))
+        track.append(mido.Message("note_off", channel=channel, note=key, time=step - step // 2))
+    return [track]
+
+
+def dense_notes(seconds, rate=200):
+    """Returns type 0 MidiFile with rate notes per second."""
+    mf = mido.MidiFile(type=0, ticks_per_beat=TICKS_PER_BEAT)
+    mf.tracks.extend(_dense(seconds, rate))
+    return mf
+
+
+def tempo_changes(seconds, rate=50):
+    """Returns type 1 MidiFile with a tempo change on every beat."""
+    mf = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+    tempo = mido.MidiTrack()
+    for beat in range(int(seconds * 2)):
+        bpm = 90 + (beat * 13) % 60
+        tempo.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm),
+                                      time=0 if beat == 0 else TICKS_PER_BEAT))
+    mf.tracks.append(tempo)
+    mf.tracks.extend(_dense(seconds, rate))
+    return mf
+
+
+def many_tracks(seconds, count=32, rate=10):
+    """Returns type 1 MidiFile with count note tracks."""
+    mf = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+    for _ in range(count):
+        mf.tracks.extend(_dense(seconds, rate))
+    return mf
+
+
+def large_sysex(seconds, size=4096, rate=2):
+    """Returns type 0 MidiFile with rate sysex messages of size bytes per second."""
+    mf = mido.MidiFile(type=0, ticks_per_beat=TICKS_PER_BEAT)
+    track = mido.MidiTrack()
+    data = [i % 128 for i in range(size)]
+    step = _ticks(1.0 / rate)
+    for i in range(int(seconds * rate)):
+        track.append(mido.Message("sysex", data=data, time=0 if i == 0 else step))
+    mf.tracks.append(track)
+    return mf
+
+
+GENERATORS = {"dense": dense_notes,
+              "tempo": tempo_changes,
+              "tracks": many_tracks,
+              "sysex": large_sysex}
+
+
+def write_files(directory, seconds):
+    """
+    Writes one file per GENERATORS entry to directory.
+
+        Returns:
+            dict kind -> filename.
+    """
+    acc = {}
+    for kind, generator in GENERATORS.items():
+        filename = os.path.join(directory, f"{kind}.mid")
+        generator(seconds).save(filename)
+        acc[kind] = filename
+    return acc
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 4)
+
+
+def _distribution(values):
+    # Summary of a list of seconds, in milliseconds.
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {"count": len(ordered),
+            "min": _ms(ordered[0]),
+            "mean": _ms(statistics.fmean(ordered)),
+            "p50": _ms(ordered[len(ordered) // 2]),
+            "p99": _ms(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]),
+            "max": _ms(ordered[-1]),
+            "stdev": _ms(statistics.pstdev(ordered))}
+
+
+def bench_compile(files, repeat=3):
+    """Returns parse and compile times per file kind, best of repeat."""
+    acc = {}
+    for kind, filename in files.items():
+        parse = compile_ = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            mf = mido.MidiFile(filename)
+            t1 = time.perf_counter()
+            timeline = rcmp.timeline.Timeline.compile(mf)
+            t2 = time.perf_counter()
+            parse = min(parse, t1 - t0)
+            compile_ = min(compile_, t2 - t1)
+        acc[kind] = {"events": len(timeline),
+                     "bytes": os.path.getsize(filename),
+                     "parse_ms": _ms(parse),
+                     "compile_ms": _ms(compile_)}
+    return acc
+
+
+def bench_playback(files, kinds=("dense", "tempo"), precision=False):
+    """
+    Plays files to a RecordingPort through Rcmp's playback loop.
+
+    Jitter is the difference between each recorded send and its deadline,
+    drift is the jitter of the final event.
+
+        Parameters:
+            precision (bool): If True play in precision mode, see rcmp.precision.
+    """
+    acc = {}
+    for kind in kinds:
+        app = rcmp.rcmp.Rcmp()
+        port = RecordingPort()
+        app._midi_output_port = rcmp.fanout.FanOut()
+        app._midi_output_port.add(port.name, port)
+        app.precision = rcmp.precision.Precision(precision)
+        app.precision.configure(app.scheduler)
+        timeline = rcmp.timeline.Timeline.load(files[kind])
+        app.stop_signal = False
+        app.precision.begin()
+        origin = app.scheduler.clock() + 0.05
+        app._play_events(timeline, timeline, origin)
+        app.precision.end()
+        jitter = [clock - (origin + t) for (clock, _), t in zip(port.sent, timeline.times)]
+        result = {"events": len(port.sent),
+                  "jitter": _distribution(jitter),
+                  "drift_ms": _ms(jitter[-1]) if jitter else None}
+        stats = app.timing_stats
+        result["lateness"] = {"max": _ms(stats.max), "p99": _ms(stats.p99),
+                              "mean": _ms(stats.mean)}
+        acc[kind] = result
+    return acc
+
+
+def bench_reset(repeat=3):
+    """
+    Returns midi_reset duration per strategy, unpaced and at DIN rate.
+    Paced resets take real time and are run once.
+    """
+    acc = {}
+    notes = [(c, k) for c in range(16) for k in range(60, 68)]
+    for strategy in rcmp.panic.STRATEGIES:
+        for rate in (0, rcmp.panic.DIN_BYTE_RATE):
+            panic = rcmp.panic.Panic(strategy, rate)
+            port = RecordingPort()
+            output = rcmp.fanout.FanOut()
+            output.add(port.name, port)
+            runs = 1 if rate else repeat
+            best = min(panic.send(output, notes, range(16)) for _ in range(runs))
+            acc[f"{strategy}@{rate or 'unpaced'}"] = {"messages": len(port.sent) // runs,
+                                                      "duration_ms": _ms(best)}
+    return acc
+
+
+def bench_scan(directory, count, seconds=2):
+    """
+    Returns MediaList.scan_directory time for count files, without an
+    index, with a cold index and with a warm index.
+    """
+    for i in range(count):
+        dense_notes(seconds, 20).save(os.path.join(directory, f"scan{i:05d}.mid"))
+    acc = {"files": count}
+
+    def scan(index):
+        media_list = rcmp.media.MediaList(None)
+        media_list.index = index
+        t0 = time.perf_counter()
+        media_list.scan_directory(directory)
+        return time.perf_counter() - t0
+
+    acc["no_index_ms"] = _ms(scan(None))
+    index = rcmp.index.MediaIndex(os.path.join(directory, "index.sqlite3"))
+    acc["cold_index_ms"] = _ms(scan(index))
+    acc["warm_index_ms"] = _ms(scan(index))
+    index.close()
+    return acc
+
+
+def run(seconds=5.0, files=200):
+    """Runs all benchmarks, returns results as dictionary."""
+    with tempfile.TemporaryDirectory(prefix="rcmp-bench-") as directory:
+        generated = write_files(directory, seconds)
+        scan_directory = os.path.join(directory, "scan")
+        os.mkdir(scan_directory)
+        return {"python": platform.python_version(),
+                "platform": platform.platform(),
+                "seconds": seconds,
+                "compile": bench_compile(generated),
+                "playback": bench_playback(generated),
+                "playback_precision": bench_playback(generated, precision=True),
+                "reset": bench_reset(),
+                "scan": bench_scan(scan_directory, files)}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="bench.py",
+                                     description="rcmp timing and throughput benchmarks.")
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="Length of generated files in seconds, default 5.")
+    parser.add_argument("--files", type=int, default=200,
+                        help="Number of files for the directory scan benchmark, default 200.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write JSON results to file instead of stdout.")
+    args = parser.parse_args(argv[1:])
+    results = run(args.seconds, args.files)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+    return 0
@@ -0,0 +1,242 @@
+# rcmp.chase
+#
+# Defines ChaseState and ChaseIndex classes.
+#
+# Starting playback part way through a file requires the receiver to be in
+# the state it would have reached by playing from the top: the same
+# programs, controllers and pitch bend on each channel.  A ChaseIndex holds
+# snapshots of that state at regular checkpoints of a Timeline, so a seek
+# replays at most one checkpoint interval of events (without sending them)
+# and then sends a handful of messages to restore the state.
+#
+# Data entry (CC 6 and 38) applies to the RPN or NRPN selected when it was
+# sent, so it is recorded per parameter number and restored together with
+# its parameter number.  Reset all controllers (CC 121) clears the state it
+# resets on the receiver and is itself sent first when restoring.
+#
+
+from array import array
+from bisect import bisect_right
+import rcmp.merge
+
+
+UNSET = 0xFF
+
+# Controllers which are not chased, channel mode messages 120..127.
+_MODE_CONTROLS = range(120, 128)
+
+# Bank select MSB and LSB are sent before program change.
+_BANK_CONTROLS = (0, 32)
+
+_DATA_MSB = 6
+_DATA_LSB = 38
+_NRPN = 99     # NRPN MSB, LSB is 98
+_RPN = 101     # RPN MSB, LSB is 100
+_RESET_CONTROLLERS = 121
+
+# Data entry, increment/decrement and parameter numbers are restored by
+# ChaseState.messages() as parameter settings, not as plain controllers.
+_PARAMETER_CONTROLS = (_DATA_MSB, _DATA_LSB, 96, 97, 98, 99, 100, 101)
+
+# Controllers left unchanged by reset all controllers, see MIDI RP-015.
+_KEPT_ON_RESET = frozenset((0, 32, 7, 10, 91, 92, 93, 94, 95) + tuple(range(70, 80)))
+
+
+class ChaseState:
+
+    """Program, controller and pitch bend state of 16 MIDI channels."""
+
+    def __init__(self):
+        self.programs = bytearray([UNSET] * 16)
+        self.controls = bytearray([UNSET] * (16 * 128))
+        self.bends = array('i', [-1] * 16)   # 14 bit value, -1 if unset
+        self.selected = bytearray([UNSET] * 16)   # _RPN or _NRPN, last selected kind.
+        self.parameters = {}    # (channel, _RPN|_NRPN, msb, lsb) -> (data msb, data lsb)
+        self.resets = bytearray(16)   # 1 if reset all controllers was seen.
+        self.tempo = rcmp.merge.DEFAULT_TEMPO
+
+    def copy(self):
+        other = ChaseState()
+        other.programs[:] = self.programs
+        other.controls[:] = self.controls
+        other.bends = array('i', self.bends)
+        other.selected[:] = self.selected
+        other.parameters = dict(self.parameters)
+        other.resets[:] = self.resets
+        other.tempo = self.tempo
+        return other
+
+    def update(self, data):
+        """
+        Updates state from the raw bytes of a channel message.
+        """
+        status = data[0]
+        kind = status & 0xF0
+        channel = status & 0x0F
+        if kind == 0xB0:
+            control = data[1]
+            if control == _DATA_MSB or control == _DATA_LSB:
+                self._data_entry(channel, control, data[2])
+            elif control == _RESET_CONTROLLERS:
+                self._reset_controllers(channel)
+            elif control not in _MODE_CONTROLS:
+                self.controls[channel * 128 + control] = data[2]
+                if control in (_RPN, _RPN - 1):
+                    self.selected[channel] = _RPN
+                elif control in (_NRPN, _NRPN - 1):
+                    self.selected[channel] = _NRPN
+        elif kind == 0xC0:
+            self.programs[channel] = data[1]
+        elif kind == 0xE0:
+            self.bends[channel] = data[1] | (data[2] << 7)
+
+    def _data_entry(self, channel, control, value):
+        # Records data entry against the selected parameter number, data
+        # entry while no parameter, or the null parameter, is selected is
+        # ignored by receivers.
+        selector = self.selected[channel]
+        if selector == UNSET:
+            return
+        base = channel * 128
+        msb, lsb = self.controls[base + selector], self.controls[base + selector - 1]
+        if msb == UNSET or lsb == UNSET or (msb, lsb) == (127, 127):
+            return
+        key = (channel, selector, msb, lsb)
+        data_msb, data_lsb = self.parameters.get(key, (UNSET, UNSET))
+        if control == _DATA_MSB:
+            self.parameters[key] = (value, data_lsb)
+        else:
+            self.parameters[key] = (data_msb, value)
+
+    def _reset_controllers(self, channel):
+        base = channel * 128
+        for control in range(128):
+            if control not in _KEPT_ON_RESET:
+                self.controls[base + control] = UNSET
+        self.bends[channel] = -1
+        self.selected[channel] = UNSET
+        self.resets[channel] = 1
+
+    def messages(self):
+        """
+        Returns list of raw messages (bytes) which restore this state.
+
+        For each channel reset all controllers is sent first if it was seen,
+        then bank select, program change, the remaining controllers, each
+        RPN and NRPN setting as parameter number followed by data entry,
+        the selected parameter number and finally pitch bend.
+        """
+        acc = []
+        controls = self.controls
+        parameters = sorted(self.parameters.items())
+        for channel in range(16):
+            base = channel * 128
+            if self.resets[channel]:
+                acc.append(bytes((0xB0 | channel, _RESET_CONTROLLERS, 0)))
+            for control in _BANK_CONTROLS:
+                value = controls[base + control]
+                if value != UNSET:
+                    acc.append(bytes((0xB0 | channel, control, value)))
+            program = self.programs[channel]
+            if program != UNSET:
+                acc.append(bytes((0xC0 | channel, program)))
+            for control in range(128):
+                value = controls[base + control]
+                if (value != UNSET and control not in _BANK_CONTROLS and
+                        control not in _PARAMETER_CONTROLS):
+                    acc.append(bytes((0xB0 | channel, control, value)))
+            for (c, selector, msb, lsb), (data_msb, data_lsb) in parameters:
+                if c != channel:
+                    continue
+                acc.append(bytes((0xB0 | channel, selector, msb)))
+                acc.append(bytes((0xB0 | channel, selector - 1, lsb)))
+                if data_msb != UNSET:
+                    acc.append(bytes((0xB0 | channel, _DATA_MSB, data_msb)))
+                if data_lsb != UNSET:
+                    acc.append(bytes((0xB0 | channel, _DATA_LSB, data_lsb)))
+            # Leave the receiver with the same parameter selected, the
+            # other kind first so that the selected kind is sent last.
+            selected = self.selected[channel]
+            order = (_RPN, _NRPN) if selected == _NRPN else (_NRPN, _RPN)
+            for selector in order:
+                for control in (selector, selector - 1):
+                    value = controls[base + control]
+                    if value != UNSET:
+                        acc.append(bytes((0xB0 | channel, control, value)))
+            bend = self.bends[channel]
+            if bend >= 0:
+                acc.append(bytes((0xE0 | channel, bend & 0x7F, bend >> 7)))
+        return acc
+
+
+class ChaseIndex:
+
+    """Checkpoints of ChaseState for a Timeline."""
+
+    def __init__(self, timeline, interval=2.0):
+        """
+        Builds ChaseIndex by a single pass over timeline.
+
+            Parameters:
+                timeline (rcmp.timeline.Timeline)
+                interval (float): Seconds between checkpoints.
+        """
+        self.timeline = timeline
+        self.interval = interval
+        self.times = array('d')      # checkpoint time in seconds
+        self.offsets = array('I')    # index of first event at or after checkpoint
+        self.states = []             # ChaseState before event offsets[i]
+        state = ChaseState()
+        times = timeline.times
+        offsets = timeline.offsets
+        data = timeline.data
+        next_checkpoint = 0.0
+        snapshot = None    # shared by consecutive checkpoints with no events between.
+        for i in range(len(times)):
+            t = times[i]
+            while t >= next_checkpoint:
+                if snapshot is None:
+                    snapshot = state.copy()
+                self.times.append(next_checkpoint)
+                self.offsets.append(i)
+                self.states.append(snapshot)
+                next_checkpoint += interval
+            state.update(data[offsets[i]:offsets[i+1]])
+            snapshot = None
+
+    @property
+    def nbytes(self):
+        """Returns approximate memory footprint in bytes."""
+        unique = {id(state): state for state in self.states}.values()
+        acc = sum(16 * 2 + 16 * 128 + 16 * 4 + len(state.parameters) * 100 for state in unique)
+        return acc + len(self.times) * 12
+
+    def seek(self, seconds):
+        """
+        Finds the event index and chased state for a position.
+
+            Parameters:
+                seconds (float): Position from start of file.
+
+            Returns:
+                tuple (index, ChaseState) where index is the first event at or
+                after seconds, and ChaseState is the state before that event.
+        """
+        timeline = self.timeline
+        n = bisect_right(self.times, seconds) - 1
+        if n < 0:
+            state, index = ChaseState(), 0
+        else:
+            state, index = self.states[n].copy(), self.offsets[n]
+        times = timeline.times
+        offsets = timeline.offsets
+        data = timeline.data
+        count = len(times)
+        while index < count and times[index] < seconds:
+            state.update(data[offsets[index]:offsets[index+1]])
+            index += 1
+        if index < count:
+            state.tempo = timeline.tempo_at(timeline.ticks[index])
+        elif count:
+            state.tempo = timeline.tempo_at(timeline.ticks[-1])
+        return index, state
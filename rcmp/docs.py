@@ -22,7 +22,9 @@ USAGE:
     and waits for OSC commands.    To terminate the program send
     the OSC message /rcmp/exit
 
-    NOTE: rcmp currently only handles single-track, type 0, MIDI files.
+    rcmp plays type 0 (single track) and type 1 (multi-track) MIDI 
+    files.  Tracks are merged as the file plays, so playback of large 
+    multi-track files starts immediately.   Type 2 files are not supported.
 
     -h --help
              Display auto-generated command-line help and exit.
@@ -38,6 +40,18 @@ USAGE:
              device may either be the numeric position in the list
              or the exact device name.  If the name is used it will 
              probably need to be quoted.  Defaults to 0.
+
+             --out may be repeated to play the same performance to 
+             several outputs, i.e.  -o 0 -o 2.  Each output is then fed
+             by its own thread, so a slow output does not delay the 
+             others.
+
+    -L --layer device
+             Adds a playback layer on MIDI output device.  Layers are
+             numbered from 1 in the order given and are controlled with
+             the /rcmp/layer/N/... OSC commands.  Each layer has its own
+             selected file, output and transport, all layers are played
+             by one thread and share the file cache.  May be repeated.
              
     -b --backend
             Sets MIDI backend.  See mido documentation.
@@ -53,6 +67,106 @@ USAGE:
        --ip
            Sets OSC server ip address, default 127.0.0.1
 
+       --reset strategy
+           Selects how MIDI output is reset after each file, when playback
+           is stopped and on exit.  Notes known to be sounding are always
+           released first.
+               full  - System reset, controllers and a note_off for every 
+                       key on every channel (over 2000 messages).  The
+                       next file starts only after it has been sent,
+                       about 2 seconds at the default --reset-rate.
+               cc    - All-sound-off and all-notes-off controllers (120, 
+                       123) on every channel.  This is the default.
+               notes - Only release the sounding notes.
+
+       --reset-rate bytes-per-second
+           Reset messages are sent in batches paced to this byte rate so 
+           that the receiving device is not overrun.  Default 3125, the
+           rate of a standard 5-pin DIN MIDI link.  Use 0 to disable 
+           pacing for fast (USB, virtual) outputs, which also makes the
+           full reset near instant.
+
+       --cache-size megabytes
+           Sets the maximum memory used to cache compiled MIDI files,
+           default 64.   Each file is parsed once and then replayed from
+           the cache until the file is modified.  When the limit is 
+           exceeded the least recently used files are discarded.
+
+    -r --recursive
+           Include MIDI files in all nested subdirectories when scanning
+           a directory.  Files are known by their name without extension.
+           If two files have the same name, the one which sorts first by 
+           path keeps the name and the other is known by its path relative
+           to the scanned directory, i.e.  'strings/intro'.
+
+    -w --watch
+           Watch the media directory and update the media-list as MIDI 
+           files are added, modified or removed, without a rescan.  Only
+           the affected files are updated, modified files are reloaded on
+           next use.  Uses inotify where available, otherwise the 
+           directory is checked every 2 seconds.
+
+    -j --jobs n
+           Number of processes used to parse new or modified MIDI files 
+           while scanning, defaults to the number of CPUs.  Files which
+           can not be read are left out of the media-list and reported
+           together at the end of the scan.
+
+       --index file
+           Sets the media index file, default
+           $XDG_CACHE_HOME/rcmp/index.sqlite3 (~/.cache/rcmp/index.sqlite3).
+           The index records the length, track count, type, tempo and 
+           event count of each MIDI file keyed by path, modification time 
+           and size.  Only new or modified files are parsed when a 
+           directory is scanned, and /rcmp/info is answered from the 
+           index.
+
+       --no-index
+           Do not use a persistent media index.  Every file is parsed,
+           and unreadable files reported, on each scan.
+
+       --stream-size n
+           Files larger than n megabytes are not compiled or cached, they
+           are memory-mapped and decoded as playback reaches each event,
+           so memory use does not grow with the size of the file.  
+           Seeking in such a file compiles it first.  0 disables, 
+           defaults to 8.
+
+       --preload-next
+           When a file is selected, also load the following file in the
+           media-list in the background.
+
+       --precision
+           Precision playback mode.  Sleep until shortly before each event
+           then spin-wait on the clock, and hold off garbage collection 
+           while playing; garbage is collected when playback ends and
+           while the tail of each queued file plays.  Lowers timing jitter at the cost of CPU
+           time, compare /rcmp/timing or bench.py with and without it.
+
+       --spin ms
+           Time spent spin-waiting before each event in precision mode,
+           default 0.5.  Increase if the OS sleep is coarse.
+
+       --realtime
+           In precision mode, request real-time (SCHED_FIFO) scheduling
+           for the playback thread while playing.  Requires permission, 
+           e.g. CAP_SYS_NICE or an rtprio limit; a warning is printed if 
+           it is refused or not supported.
+
+       --log-level debug|info|warning|error
+           Minimum level of messages shown, default info.  Messages are
+           written by a background thread from a bounded queue so a slow
+           terminal never delays playback; if the queue fills up messages
+           are dropped and a count of dropped messages is reported.
+
+       --log-file filename
+           Also append log messages to filename, one JSON object per line
+           with time, level, message and any extra fields.
+
+       --startup-profile
+           Print the time taken by each startup step: argument parsing,
+           imports, MIDI backend, index, media scan, MIDI outputs and OSC.
+
     -p --play
            Immediately play the MIDI file specified by the optional 
            file argument.  The --play option is ignored if the file
@@ -68,6 +182,9 @@ USAGE:
 OSC_COMMANDS = """
 OSC COMMANDS:
 
+    Commands may be sent as individual messages or grouped in OSC 
+    bundles, the messages in a bundle are handled in order.
+
     /rcmp/exit
         Terminate rcmp.
         
@@ -75,25 +192,148 @@ OSC COMMANDS:
         Start playback of selected MIDI file.
         
     /rcmp/stop
-        Stop playback, there may be a few seconds delay
-        before the playback halts.
+        Stop playback.
         
-    /rcmp/list
-        Display the media-list, an asterisk indicates the currently 
-        selected file.
+    /rcmp/seek seconds
+        Set the playback position.  If a file is playing, playback 
+        continues from the new position, otherwise the next /rcmp/play
+        starts there.  Program, controller and pitch bend state at the
+        new position are sent before playback resumes.
+
+    /rcmp/tempo [factor]
+        Scale playback speed, 1.0 plays at the file's own tempo, 0.95 is
+        5% slower and 1.1 is 10% faster.  The change takes effect 
+        immediately, mid-file, without a jump in position, and applies 
+        to following files until changed.  Without an argument, display 
+        the current factor and playback position (in file seconds).
+
+    /rcmp/queue [file...]
+        Append files to the play queue and display the queue.  Files are
+        specified as for /rcmp/select.   When the current file ends, the
+        next queued file starts without a gap:  it is loaded in advance, 
+        its timing continues on the same clock and only the notes still
+        sounding are released in between.  The full reset is sent once 
+        the queue is exhausted.
+
+    /rcmp/unqueue
+        Clear the play queue.
+
+    /rcmp/next
+        Skip to the next queued file.  If no file is playing, the next 
+        queued file is removed from the queue and selected.
+
+    /rcmp/list [offset] [limit]
+        Send part of the media-list to the sender as an OSC bundle, 
+        starting at list-index offset (default 0), at most limit items
+        (default 20, maximum 100):
+
+            /rcmp/list/page   offset count total
+            /rcmp/list/item   list-index name selected length
+
+        selected is 1 for the currently selected file.  length is in 
+        seconds, or -1 if the file has not been indexed yet; no files 
+        are read to answer /rcmp/list.  The items are also printed.
         
-    /rcmp/info
-        Display details about currently selected MIDI file.
+    /rcmp/info [file]
+        Send details about the currently selected MIDI file, or file
+        given by name or list-index, to the sender:
+
+            /rcmp/info  list-index name filename length type tracks
+                        events ticks-per-beat bpm min-bpm max-bpm 
+                        tempo-changes
+
+        Details are taken from the index when the file is unchanged, 
+        the values after filename are left out if the file can not be
+        read, and the message has no values if there is no such file.
+        The details are also printed.
         
+    /rcmp/find text [offset] [limit]
+        Search media-list for names matching text, ignoring case.
+        Names starting with text are listed first, then names containing
+        text, then names containing the letters of text in order, i.e. 
+        'vln2' finds 'violin-part-2'.  Matches are printed and sent to
+        the sender as an OSC bundle, paged as /rcmp/list:  starting at 
+        match offset (default 0), at most limit matches (default 20,
+        maximum 100):
+
+            /rcmp/find/page   text offset count total
+            /rcmp/find/item   list-index name     (one per match)
+
     /rcmp/scan directory
         First clear the media list.  Then, load each MIDI file 
-        in directory into the media-list.
+        in directory into the media-list.  Nested directories are
+        included if rcmp was started with --recursive.  The number of
+        files and the selected file are printed, use /rcmp/list to 
+        browse the list.
         
     /rcmp/select file
         Select file from media-list. The file may be specified either
         by it's position in the media-list, or by name.  If the name 
         is used, do not include filename extension.
+        The selected file is loaded in the background so that a 
+        following /rcmp/play starts without delay.  /rcmp/info and
+        /rcmp/timing report whether the preload was ready (hit), still 
+        loading (wait) or had to be loaded on demand (miss).
     
+    /rcmp/timing
+        Display timing accuracy of the most recent playback run.
+        Lateness is measured against an absolute clock started at the 
+        beginning of the file, reports maximum, 99th percentile and mean
+        lateness, jitter (standard deviation of lateness), and the final
+        event lateness (end of file drift).  Runs in precision mode show 
+        the spin time.
+        The wake latency is the time from the /rcmp/play request to the
+        first MIDI byte, excluding any lead-in at the start of the file.
+
+    /rcmp/stats [port]
+        Reply to the sender with live metrics as an OSC bundle, nothing
+        is printed.  The reply is sent to the sender's address and port,
+        or to port if given.  The bundle contains one message per metric:
+
+            /rcmp/stats/state      'playing' or 'stopped'
+            /rcmp/stats/file       file being played
+            /rcmp/stats/position   seconds, -1 if stopped
+            /rcmp/stats/events     events sent in the current run
+            /rcmp/stats/rate       events per second since previous request
+            /rcmp/stats/late       events more than 1 ms late
+            /rcmp/stats/lateness   max, mean and approximate p99 in ms
+            /rcmp/stats/jitter     standard deviation of lateness in ms
+            /rcmp/stats/histogram  event count per lateness bucket
+            /rcmp/stats/bounds     bucket upper bounds in ms
+            /rcmp/stats/cache      hit rate, hits, misses
+            /rcmp/stats/cpu        process CPU use since previous request
+            /rcmp/stats/osc        datagrams received, messages dispatched
+
+        The /rcmp prefix is replaced by the --osc prefix.
+
+    /rcmp/outputs
+        Display MIDI outputs with the number of messages sent and the
+        send latency (time from scheduling to completed send) for the 
+        most recent file.
+
+    /rcmp/layers
+        Display state of all layers.
+
+    /rcmp/layer/N/select name
+        Select file for layer N, as /rcmp/select.
+
+    /rcmp/layer/N/play
+        Start layer N from the top of its file.  If the file is still
+        being compiled the layer starts once it is ready, a stop in the
+        meantime cancels the start.
+
+    /rcmp/layer/N/stop
+        Stop layer N and release its sounding notes.
+
+    /rcmp/layer/all/play
+    /rcmp/layer/all/stop
+        Start or stop all layers.  Layers started together share the
+        same start time and remain aligned.
+
+    /rcmp/voices
+        Display the notes currently sounding on each channel.  Notes 
+        held only by the sustain pedal are marked with '*'.
+
     /rcmp/help
         Display this message.
 
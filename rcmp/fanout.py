@@ -0,0 +1,183 @@
+# rcmp.fanout
+#
+# Defines PortSender and FanOut classes.
+#
+# FanOut looks like a single mido output port but copies every message to
+# several outputs.  With more than one output, each port is fed from its
+# own queue by its own thread, so a slow or blocked port delays only itself.
+#
+# Playback sends the raw message bytes stored in the Timeline with
+# send_bytes().  Where the backend accepts raw bytes they are passed straight
+# through, skipping construction, validation and re-encoding of a mido
+# Message for every event.
+#
+
+import queue
+import threading
+import time
+import mido
+import rcmp.scheduler
+
+
+def raw_sender(port):
+    """
+    Returns function which sends raw message bytes to port.
+
+    Ports which define send_raw(data) are used directly.  For the rtmidi
+    backend the bytes are passed to the underlying rtmidi port.  Any other
+    port is sent a mido Message decoded from the bytes.
+
+        Parameters:
+            port (mido output port)
+
+        Returns:
+            function(data)
+    """
+    send_raw = getattr(port, "send_raw", None)
+    if send_raw is not None:
+        return send_raw
+    rt = getattr(port, "_rt", None)
+    if rt is not None and hasattr(rt, "send_message"):
+        return rt.send_message
+    send = port.send
+    from_bytes = mido.Message.from_bytes
+    return lambda data: send(from_bytes(data))
+
+
+class PortSender:
+
+    """Sends messages to one MIDI output port and records send latency."""
+
+    def __init__(self, name, port, threaded=True, clock=time.perf_counter):
+        """
+        Constructs new instance of PortSender.
+
+            Parameters:
+                name (str): Output name.
+                port (mido output port)
+                threaded (bool): If True, messages are queued and sent by a
+                    dedicated thread.  If False they are sent by the caller.
+                clock (function): Clock used to measure latency.
+        """
+        self.name = name
+        self.port = port
+        self.clock = clock
+        self.stats = rcmp.scheduler.LatenessStats(name)
+        self._send_raw = raw_sender(port)
+        self._queue = None
+        self._thread = None
+        if threaded:
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def send(self, msg):
+        """Sends mido Message."""
+        self._put(self.port.send, msg)
+
+    def send_bytes(self, data):
+        """Sends raw message bytes, status byte first."""
+        self._put(self._send_raw, data)
+
+    def _put(self, send, arg):
+        if self._queue is None:
+            t = self.clock()
+            send(arg)
+            self.stats.add(self.clock() - t)
+        else:
+            self._queue.put((self.clock(), send, arg))
+
+    def _run(self):
+        get = self._queue.get
+        clock = self.clock
+        add = self.stats.add
+        while True:
+            item = get()
+            if item is None:
+                break
+            t, send, arg = item
+            send(arg)
+            add(clock() - t)
+
+    @property
+    def backlog(self):
+        """Returns number of queued messages not yet sent."""
+        if self._queue is None:
+            return 0
+        return self._queue.qsize()
+
+    def close(self, timeout=1.0):
+        """
+        Sends any queued messages, then closes the port.
+        """
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+        self.port.close()
+
+    def __str__(self):
+        s = self.stats
+        return (f"'{self.name}'  sent {s.count}  latency max {s.max * 1000:.3f}"
+                f"  p99 {s.p99 * 1000:.3f}  mean {s.mean * 1000:.3f} ms  backlog {self.backlog}")
+
+
+class FanOut:
+
+    """Output port which copies each message to several PortSenders."""
+
+    def __init__(self, threaded=False):
+        """
+        Constructs new instance of FanOut.
+
+            Parameters:
+                threaded (bool): If True every port is fed by its own thread,
+                    even if it is the only one.
+        """
+        self.senders = []
+        self._threaded = threaded
+
+    def add(self, name, port):
+        """
+        Adds output port.
+
+        When a second port is added all senders are switched to threaded
+        mode, a single port is sent to directly unless threaded was set.
+        """
+        if len(self.senders) == 1 and not self._threaded:
+            first = self.senders[0]
+            self.senders[0] = PortSender(first.name, first.port, True)
+            self._threaded = True
+        self.senders.append(PortSender(name, port, self._threaded))
+
+    @property
+    def names(self):
+        return [s.name for s in self.senders]
+
+    def send(self, msg):
+        for sender in self.senders:
+            sender.send(msg)
+
+    def send_bytes(self, data):
+        for sender in self.senders:
+            sender.send_bytes(data)
+
+    def clear_stats(self):
+        for sender in self.senders:
+            sender.stats.clear(sender.name)
+
+    def close(self):
+        for sender in self.senders:
+            sender.close()
+        self.senders = []
+
+    def __len__(self):
+        return len(self.senders)
+
+    def __bool__(self):
+        return bool(self.senders)
+
+    def __str__(self):
+        acc = "MIDI outputs:"
+        for sender in self.senders:
+            acc += f"\n    {sender}"
+        return acc
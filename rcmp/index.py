@@ -0,0 +1,182 @@
+# rcmp.index
+#
+# Defines MediaInfo and MediaIndex classes.
+#
+# MediaIndex is a persistent SQLite table of per-file metadata keyed by
+# path, modification time and size.  It lets the media-list be rescanned
+# and queried without parsing files which have not changed.
+#
+
+import os
+import os.path as path
+import sqlite3
+import threading
+import rcmp.merge
+
+
+def default_index_filename():
+    """
+    Returns default index location, $XDG_CACHE_HOME/rcmp/index.sqlite3
+    """
+    cache = os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return path.join(cache, "rcmp", "index.sqlite3")
+
+
+class MediaInfo:
+
+    """Summary of a single MIDI file."""
+
+    FIELDS = ("duration", "track_count", "midi_type", "event_count",
+              "ticks_per_beat", "initial_bpm", "min_bpm", "max_bpm", "tempo_changes")
+
+    def __init__(self, duration=0.0, track_count=0, midi_type=0, event_count=0,
+                 ticks_per_beat=0, initial_bpm=120.0, min_bpm=120.0, max_bpm=120.0,
+                 tempo_changes=0):
+        self.duration = duration
+        self.track_count = track_count
+        self.midi_type = midi_type
+        self.event_count = event_count
+        self.ticks_per_beat = ticks_per_beat
+        self.initial_bpm = initial_bpm
+        self.min_bpm = min_bpm
+        self.max_bpm = max_bpm
+        self.tempo_changes = tempo_changes
+
+    @classmethod
+    def from_timeline(cls, timeline):
+        """
+        Creates MediaInfo from a compiled rcmp.timeline.Timeline.
+        """
+        tempos = timeline.tempo_values
+        if tempos and timeline.tempo_ticks[0] == 0:
+            initial = tempos[0]
+        else:
+            initial = rcmp.merge.DEFAULT_TEMPO
+        bpms = [60000000 / t for t in tempos if t] or [60000000 / initial]
+        return cls(duration=timeline.length,
+                   track_count=timeline.track_count,
+                   midi_type=timeline.midi_type,
+                   event_count=len(timeline),
+                   ticks_per_beat=timeline.ticks_per_beat,
+                   initial_bpm=60000000 / initial,
+                   min_bpm=min(bpms),
+                   max_bpm=max(bpms),
+                   tempo_changes=len(tempos))
+
+    def as_tuple(self):
+        return tuple(getattr(self, f) for f in self.FIELDS)
+
+    def __str__(self):
+        acc = f"Length {self.duration} seconds.\n"
+        acc += f"Type {self.midi_type}, {self.track_count} tracks, {self.event_count} events.\n"
+        acc += f"Tempo {self.initial_bpm:.2f} BPM"
+        if self.tempo_changes > 1:
+            acc += f" ({self.min_bpm:.2f}..{self.max_bpm:.2f}, {self.tempo_changes} changes)"
+        return acc
+
+
+class MediaIndex:
+
+    """Persistent MediaInfo store keyed by (path, mtime, size)."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS media (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            duration REAL,
+            track_count INTEGER,
+            midi_type INTEGER,
+            event_count INTEGER,
+            ticks_per_beat INTEGER,
+            initial_bpm REAL,
+            min_bpm REAL,
+            max_bpm REAL,
+            tempo_changes INTEGER)
+    """
+
+    def __init__(self, filename=None):
+        """
+        Opens, or creates, a MediaIndex.
+
+            Parameters:
+                filename (str): Index database file, defaults to
+                    default_index_filename().  Use ':memory:' for a
+                    non-persistent index.
+        """
+        if not filename:
+            filename = default_index_filename()
+        if filename != ":memory:":
+            os.makedirs(path.dirname(path.abspath(filename)), exist_ok=True)
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute(self.SCHEMA)
+
+    def lookup(self, filename, stamp):
+        """
+        Retrieves MediaInfo for filename.
+
+            Parameters:
+                filename (str): Absolute path.
+                stamp (tuple): (mtime_ns, size) of the file.
+
+            Returns:
+                MediaInfo, or None if filename is not indexed or the index
+                entry is stale.
+        """
+        cols = ", ".join(MediaInfo.FIELDS)
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT mtime_ns, size, {cols} FROM media WHERE path = ?",
+                (filename,)).fetchone()
+        if row and (row[0], row[1]) == tuple(stamp):
+            return MediaInfo(*row[2:])
+        return None
+
+    def load_directory(self, directory):
+        """
+        Returns dictionary of all entries below directory.
+
+        The dictionary maps path -> ((mtime_ns, size), MediaInfo).
+        """
+        cols = ", ".join(MediaInfo.FIELDS)
+        # Every path below directory sorts between "directory/" and the
+        # string with the trailing separator replaced by its successor.
+        prefix = path.join(directory, "")
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT path, mtime_ns, size, {cols} FROM media WHERE path >= ? AND path < ?",
+                (prefix, upper)).fetchall()
+        return {row[0]: ((row[1], row[2]), MediaInfo(*row[3:])) for row in rows}
+
+    def store(self, entries):
+        """
+        Adds or replaces index entries.
+
+            Parameters:
+                entries (iterable): Of tuples (path, (mtime_ns, size), MediaInfo).
+        """
+        rows = [(p, stamp[0], stamp[1]) + info.as_tuple() for p, stamp, info in entries]
+        if not rows:
+            return
+        marks = ", ".join("?" * (3 + len(MediaInfo.FIELDS)))
+        with self._lock, self._db:
+            self._db.executemany(f"INSERT OR REPLACE INTO media VALUES ({marks})", rows)
+
+    def remove(self, filenames):
+        """Removes index entries for each path in filenames."""
+        rows = [(p,) for p in filenames]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM media WHERE path = ?", rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __str__(self):
+        return f"MediaIndex '{self.filename}'"
@@ -0,0 +1,274 @@
+# rcmp.layers
+#
+# Defines Layer and LayerMixer classes.
+#
+# A Layer is an independent playback channel with its own selected file,
+# MIDI output, voice table and transport state.  All layers are played by a
+# single LayerMixer thread, which keeps a heap of the next event deadline of
+# every playing layer and sleeps until the earliest one.  Layers read their
+# Timelines through the shared MediaList cache, so several layers playing the
+# same file share one compiled copy.  Files larger than the media-list's
+# stream_size are played from rcmp.smf.SMFStream instead.
+#
+# Layers started together are given the same clock origin and therefore stay
+# aligned for the length of the file.  Their timelines are fetched on a
+# loader thread, so a start request returns at once even while a file is
+# still being compiled, and the origin is taken once all of them are ready.
+#
+# The mixer lock only guards the heap and transport state.  Messages are sent
+# under each layer's own send_lock, so a slow output can not hold up other
+# layers or OSC requests.
+#
+
+import heapq
+import time
+from threading import Event, Lock, Thread
+import rcmp.log
+import rcmp.scheduler
+import rcmp.voices
+
+
+# Delay between a layer start request and its first event, leaves time to
+# start several layers on the same origin.
+START_LEAD = 0.005
+
+
+class Layer:
+
+    """Playback state of a single layer."""
+
+    def __init__(self, number, name=None, port=None):
+        """
+        Constructs new instance of Layer.
+
+            Parameters:
+                number (int): Layer number, as used in OSC addresses.
+                name (str): Optional MIDI output name.
+                port (rcmp.fanout.FanOut): Optional MIDI output.
+        """
+        self.number = number
+        self.name = name
+        self.port = port
+        self.item = None           # selected MediaItem
+        self.timeline = None
+        self.origin = None         # clock value of file time 0, None if stopped.
+        self.events = None         # iterator over the timeline's (seconds, bytes).
+        self.pending = None        # next (seconds, bytes) event.
+        self.generation = 0        # incremented on every start and stop.
+        self.voices = rcmp.voices.VoiceTable()
+        self.stats = rcmp.scheduler.LatenessStats()
+        self.send_lock = Lock()    # orders event sends against note release.
+
+    @property
+    def is_playing(self):
+        return self.origin is not None
+
+    def position(self, now):
+        """Returns position in file seconds, or None if stopped."""
+        if self.origin is None:
+            return None
+        return now - self.origin
+
+    def __str__(self):
+        alias = self.item.alias if self.item else None
+        state = "playing" if self.is_playing else "stopped"
+        return f"Layer {self.number}: {state}  '{alias}'  output '{self.name}'"
+
+
+class LayerMixer:
+
+    """Plays all layers from a single thread."""
+
+    def __init__(self, media_list, panic, clock=time.perf_counter):
+        """
+        Constructs new instance of LayerMixer.
+
+            Parameters:
+                media_list (rcmp.media.MediaList): Source of items and timelines.
+                panic (rcmp.panic.Panic): Used to release notes on stop.
+                clock (function): Monotonic clock, should be the same as the
+                    main scheduler's clock.
+        """
+        self.media_list = media_list
+        self.panic = panic
+        self.clock = clock
+        self.layers = []
+        self._heap = []            # (deadline, layer number, generation)
+        self._lock = Lock()
+        self._wake = Event()
+        self._closed = False
+        self._thread = None
+
+    def add(self, name, port):
+        """Appends a new layer and returns it."""
+        layer = Layer(len(self.layers) + 1, name, port)
+        self.layers.append(layer)
+        return layer
+
+    def layer(self, number):
+        """Returns layer by number (starting at 1) or None."""
+        if 1 <= number <= len(self.layers):
+            return self.layers[number - 1]
+        return None
+
+    def select(self, layer, alias):
+        """
+        Selects media-list item for layer.
+
+            Returns:
+                MediaItem or None if alias is invalid.
+        """
+        mi = self.media_list.find(alias)
+        if mi:
+            layer.item = mi
+            self.media_list.request(mi)
+        return mi
+
+    def play(self, layers, origin=None):
+        """
+        Starts playback of layers from the top of their files.
+
+        Returns without waiting for the timelines, which are fetched on a
+        loader thread.  Stopping or restarting a layer before its timeline
+        is ready cancels the start.
+
+            Parameters:
+                layers (list): Of Layer, all are started on the same origin.
+                origin (float): Optional clock value of file time 0, by
+                    default START_LEAD after the timelines are ready.
+
+            Returns:
+                List of layers being started.
+        """
+        requests = []
+        for layer in layers:
+            if layer.item is None or layer.port is None:
+                continue
+            self.stop(layer)
+            requests.append((layer, layer.item, layer.generation))
+        if requests:
+            self._start_thread()
+            Thread(target=self._load, args=(requests, origin), daemon=True).start()
+        return [layer for layer, _, _ in requests]
+
+    def _load(self, requests, origin):
+        # Runs on its own thread, a file still being compiled by the
+        # preloader delays only the layers waiting for it.
+        started = []
+        for layer, mi, generation in requests:
+            timeline = self.media_list.playable(mi, stream=True)
+            if timeline is None:
+                rcmp.log.error(f"Layer {layer.number} can not play '{mi.filename}'")
+                continue
+            started.append((layer, timeline, generation))
+        if origin is None:
+            origin = self.clock() + START_LEAD
+        with self._lock:
+            if self._closed:
+                return
+            for layer, timeline, generation in started:
+                if generation != layer.generation:
+                    continue    # stopped or restarted while loading.
+                layer.timeline = timeline
+                layer.origin = origin
+                layer.events = iter(timeline)
+                layer.pending = next(layer.events, None)
+                layer.stats.clear(timeline.filename)
+                if layer.pending:
+                    heapq.heappush(self._heap, (origin + layer.pending[0],
+                                                layer.number, generation))
+        self._wake.set()
+
+    def stop(self, layer):
+        """
+        Stops layer and releases its sounding notes.
+        """
+        with self._lock:
+            layer.origin = None
+            layer.events = layer.pending = None
+            layer.generation += 1    # invalidates pending heap entry.
+        # Also after the final event, which the mixer may still be sending.
+        with layer.send_lock:
+            self._release(layer)
+
+    def stop_all(self):
+        for layer in self.layers:
+            self.stop(layer)
+
+    def _release(self, layer):
+        voices = layer.voices
+        self.panic.send(layer.port, voices.sounding(), voices.pedals(), sweep=False)
+        voices.clear()
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        heap = self._heap
+        clock = self.clock
+        wake = self._wake
+        while not self._closed:
+            if not heap:
+                wake.wait()
+                wake.clear()
+                continue
+            delay = heap[0][0] - clock()
+            if delay > 0:
+                if wake.wait(delay):
+                    wake.clear()
+                continue
+            finished = False
+            with self._lock:
+                deadline, number, generation = heapq.heappop(heap)
+                layer = self.layers[number - 1]
+                if generation != layer.generation:
+                    continue
+                _, data = layer.pending
+                layer.pending = next(layer.events, None)
+                if layer.pending:
+                    heapq.heappush(heap, (layer.origin + layer.pending[0],
+                                          number, generation))
+                else:
+                    layer.origin = None
+                    layer.events = None
+                    layer.generation += 1
+                    generation += 1
+                    finished = True
+            with layer.send_lock:
+                # Skipped if the layer was stopped since the event was taken,
+                # stop() has then released its notes.
+                if generation != layer.generation:
+                    continue
+                layer.port.send_bytes(data)
+                layer.voices.update(data)
+                layer.stats.add(clock() - deadline)
+                if finished:
+                    self._release(layer)
+
+    def close(self):
+        """Stops all layers, ends the mixer thread and closes layer outputs."""
+        self.stop_all()
+        self._closed = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(1.0)
+        for layer in self.layers:
+            if layer.port:
+                layer.port.close()
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __str__(self):
+        acc = "Layers:"
+        now = self.clock()
+        for layer in self.layers:
+            acc += f"\n    {layer}"
+            position = layer.position(now)
+            if position is not None:
+                acc += f"  position {max(0.0, position):.3f}"
+            if layer.stats.count:
+                acc += f"  late max {layer.stats.max * 1000:.3f} ms"
+        return acc
@@ -0,0 +1,182 @@
+# rcmp.log
+#
+# Defines Logger class and module level logging functions.
+#
+# Callers never write to the terminal themselves.  Each record is pushed
+# onto a bounded queue and written by a background thread, so a slow
+# terminal or pipe can not block the OSC or playback threads.  When the
+# queue is full records are dropped and counted rather than waited for.
+#
+# Records have a level, warnings and errors are written with a 'WARNING: '
+# or 'ERROR: ' prefix.  console() is used for interactive output (prompt,
+# listings), which is written as is.  Optionally every log record, but not
+# console output, is also appended to a JSON-lines file.
+#
+
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name.lower(): level for level, name in LEVEL_NAMES.items()}
+
+_CONSOLE = None    # level of console records, written to the stream only.
+
+
+class Logger:
+
+    """Asynchronous logger with a bounded queue."""
+
+    def __init__(self, stream=None, level=INFO, max_queue=4096):
+        """
+        Constructs new instance of Logger.
+
+            Parameters:
+                stream (file): Output stream, defaults to sys.stdout at the
+                    time each record is written.
+                level (int): Records below level are discarded.
+                max_queue (int): Maximum number of pending records.
+        """
+        self.stream = stream
+        self.level = level
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._file = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._reported = 0     # dropped count last reported.
+
+    def open_file(self, filename):
+        """
+        Appends log records to filename as JSON lines.
+
+        Raises OSError if filename can not be opened.
+        """
+        self._file = open(filename, "a", encoding="utf-8")
+
+    def log(self, level, message, end="\n", **fields):
+        """
+        Queues a record, never blocks.
+
+            Parameters:
+                level (int): DEBUG, INFO, WARNING or ERROR.
+                message (str)
+                end (str): Appended to message on the stream.
+                fields: Optional extra values for the JSON-lines file.
+        """
+        if level is not _CONSOLE and level < self.level:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((time.time(), level, str(message), end, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, message, **fields):
+        self.log(DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(ERROR, message, **fields)
+
+    def console(self, message="", end="\n"):
+        """Queues interactive output, written as is and never filtered."""
+        self.log(_CONSOLE, message, end)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _writer(self):
+        get = self._queue.get
+        while True:
+            record = get()
+            self._write(record)
+            while True:
+                try:
+                    record = get(block=False)
+                except queue.Empty:
+                    break
+                self._write(record)
+            self._flush_streams()
+
+    def _write(self, record):
+        stream = self.stream or sys.stdout
+        if self.dropped != self._reported:
+            stream.write(f"WARNING: {self.dropped - self._reported} log records dropped\n")
+            self._reported = self.dropped
+        if isinstance(record, threading.Event):    # flush marker
+            self._flush_streams()
+            record.set()
+            return
+        stamp, level, message, end, fields = record
+        if level is _CONSOLE:
+            stream.write(message + end)
+            return
+        if level >= WARNING:
+            stream.write(f"{LEVEL_NAMES[level]}: {message}{end}")
+        else:
+            stream.write(message + end)
+        if self._file:
+            entry = {"time": stamp, "level": LEVEL_NAMES.get(level, level), "message": message}
+            entry.update(fields)
+            self._file.write(json.dumps(entry, default=str) + "\n")
+
+    def _flush_streams(self):
+        try:
+            (self.stream or sys.stdout).flush()
+            if self._file:
+                self._file.flush()
+        except (OSError, ValueError):
+            pass
+
+    def flush(self, timeout=1.0):
+        """
+        Waits until queued records are written, at most timeout seconds.
+        """
+        if self._thread is None:
+            return
+        marker = threading.Event()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.wait(timeout)
+
+    def close(self):
+        self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __str__(self):
+        return (f"Logger  level: {LEVEL_NAMES.get(self.level, self.level)}"
+                f"  pending: {self._queue.qsize()}  dropped: {self.dropped}")
+
+
+LOGGER = Logger()
+
+debug = LOGGER.debug
+info = LOGGER.info
+warning = LOGGER.warning
+error = LOGGER.error
+console = LOGGER.console
+flush = LOGGER.flush
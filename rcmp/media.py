@@ -3,9 +3,40 @@
 # Defines MediaItem and MediaList classes.
 #
 
+from bisect import bisect_left, insort
+import concurrent.futures
 import os
 import os.path as path
+import re
 import mido
+import rcmp.timeline
+import rcmp.preload
+import rcmp.index
+import rcmp.log
+import rcmp.smf
+import rcmp.watch
+
+def describe(filename):
+    """
+    Parses MIDI file.
+
+    This is a module level function so that it may be run in a process pool.
+
+        Parameters:
+            filename (str)
+
+        Returns:
+            tuple (MediaInfo, None) on success, or (None, error message).
+            Never raises, so one bad file can not abort a scan.
+    """
+    try:
+        timeline = rcmp.timeline.Timeline.load(filename)
+    except rcmp.timeline.LOAD_ERRORS as err:
+        return None, str(err) or type(err).__name__
+    except Exception as err:
+        return None, repr(err)
+    return rcmp.index.MediaInfo.from_timeline(timeline), None
+
 
 class MediaItem:
 
@@ -25,6 +56,8 @@ class MediaItem:
             self._alias = alias
         else:
             self._alias = path.splitext(path.basename(filename))[0]
+        self.stamp = None     # (mtime_ns, size) when info was taken.
+        self.info = None      # rcmp.index.MediaInfo
 
     @property
     def filename(self):
@@ -64,6 +97,7 @@ class MediaList:
     """
 
     EXTENSIONS = [".mid", ".syx"]
+    REPORT_LIMIT = 20    # Maximum number of unreadable files listed after a scan.
 
     @classmethod
     def accept(cls, filename):
@@ -92,42 +126,104 @@ class MediaList:
         """
         self.app = app
         self._items = {}
+        self._sorted = []     # aliases in sort order, maintained by add and _remove.
+        self._folded = []     # (alias.lower(), alias) in sort order, for search.
         self._directory = None
         self._current_item = None
+        self.cache = rcmp.timeline.TimelineCache()
+        self.preloader = rcmp.preload.Preloader(self.cache)
+        self.preload_ahead = 0
+        self.index = None     # Optional rcmp.index.MediaIndex
+        self.recursive = False
+        self.jobs = None      # Process pool size used to parse files, None -> cpu count.
+        self.stream_size = 8 * 1024 * 1024   # Larger files are played with rcmp.smf, None -> never.
+        self.watcher = None   # Optional rcmp.watch watcher of the list directory.
+        self._dispatch = None
        
 
     @property
     def current_item(self):
         return self._current_item
             
-    def add(self, filename):
+    def add(self, filename, alias=None):
         """
         Adds new item to the list.
 
             Parameters:
                 filename (str): The filename is added iff it is determined to be a MIDI file.
                 The filename extension is ignored.
+                alias (str): Optional alias, defaults to the basename without extension.
+
+            Returns:
+                The new MediaItem.
         """
-        mi = MediaItem(filename)
+        mi = MediaItem(filename, alias)
+        if mi.alias not in self._items:
+            insort(self._sorted, mi.alias)
+            insort(self._folded, (mi.alias.lower(), mi.alias))
         self._items[mi.alias] = mi
+        return mi
+
+    def _remove(self, alias):
+        del self._items[alias]
+        del self._sorted[bisect_left(self._sorted, alias)]
+        del self._folded[bisect_left(self._folded, (alias.lower(), alias))]
 
     # Automatically marks the first filename as 'selected',
     # but only if there is not a currently selected file.
     def _auto_select(self):
-        if not self._current_item:
-            alist = self.aliases
-            if len(alist):
-                self.select(alist[0])
-            
-    def scan_directory(self, directory):
+        if not self._current_item and self._sorted:
+            self.select(self._sorted[0])
+
+    @classmethod
+    def _list_directory(cls, directory, recursive):
+        # Returns sorted list of relative paths of MIDI files in directory.
+        # Files directly in directory come first, then nested files in path
+        # order.  Raises OSError if directory itself can not be read.
+        names = [n for n in os.listdir(directory) if cls.accept(n)]
+        names.sort()
+        if recursive:
+            nested = []
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                if root == directory:
+                    continue
+                rel = path.relpath(root, directory)
+                nested.extend(path.join(rel, n) for n in sorted(files) if cls.accept(n))
+            names.extend(nested)
+        return names
+
+    @staticmethod
+    def _aliases_for(relpath):
+        # Candidate aliases for a file, in order of preference: the basename,
+        # the relative path, then the relative path with extension.
+        stem = path.splitext(relpath)[0]
+        yield path.basename(stem)
+        yield stem.replace(os.sep, "/")
+        yield relpath.replace(os.sep, "/")
+
+    def _add_relative(self, directory, relpath):
+        for alias in self._aliases_for(relpath):
+            if alias not in self._items:
+                break
+        return self.add(path.join(directory, relpath), alias)
+
+    def scan_directory(self, directory, recursive=None):
         """
         Clears the list and then adds all MIDI files in directory.
             
         If there is no current file, the first MIDI file in the directory is
         selected.
 
+        Files are normally known by their basename.  When two files share a
+        basename, the first in path order keeps it and the others are known
+        by their path relative to directory, so the result does not depend 
+        on directory listing order.
+
             Parameters:
                directory (str): Name of directory
+               recursive (bool): If True, include MIDI files in all nested
+                   subdirectories, defaults to self.recursive.
 
             Returns:
                False if directory could no be read.
@@ -136,23 +232,188 @@ class MediaList:
         rs = False
         self.clear()
         directory = path.expanduser(directory)
+        if recursive is None:
+            recursive = self.recursive
         try:
-            for file_name in os.listdir(directory):
-                print(f"DEBUG scan file_name = {file_name}")
-                if self.accept(file_name):
-                    self.add(path.join(directory, file_name))
-                    self._directory = directory
+            for relpath in self._list_directory(directory, recursive):
+                self._add_relative(directory, relpath)
+            self._directory = directory
+            self._validate(directory, recursive)
             self._auto_select()
+            if self.watcher is not None and self.watcher.directory != directory:
+                self.watch(self._dispatch)
             rs = True
         except IOError:
-            msg = f"ERROR: Can not scan directory: '{directory}'"
-            print(msg)
-        finally:
-            return rs
+            rcmp.log.error(f"Can not scan directory: '{directory}'", directory=directory)
+        return rs
+
+    # Attaches MediaInfo to every item in directory.  Items whose path,
+    # mtime and size match the index are not parsed, changed or new files
+    # are parsed and written back, and entries for deleted files are dropped.
+    # Without an index every file is parsed.  Files which can not be parsed
+    # are removed from the list and reported together once the scan is
+    # complete.
+    def _validate(self, directory, recursive=False):
+        known = self.index.load_directory(directory) if self.index else {}
+        pending = []
+        seen = set()
+        for mi in self._items.values():
+            filename = mi.filename
+            seen.add(filename)
+            try:
+                stamp = rcmp.timeline.TimelineCache.stamp(filename)
+            except OSError:
+                continue
+            entry = known.get(filename)
+            if entry and entry[0] == stamp:
+                mi.stamp, mi.info = entry
+            else:
+                pending.append((mi, stamp))
+        changed = []
+        failed = []
+        filenames = [mi.filename for mi, _ in pending]
+        for (mi, stamp), (info, error) in zip(pending, self._describe_all(filenames)):
+            if info:
+                mi.stamp, mi.info = stamp, info
+                changed.append((mi.filename, stamp, info))
+            else:
+                failed.append((mi, error))
+                self._remove(mi.alias)
+        if self.index:
+            self.index.store(changed)
+            removed = [p for p in known if p not in seen and
+                       (recursive or path.dirname(p) == directory)]
+            self.index.remove(removed)
+        if failed:
+            msg = f"{len(failed)} of {len(self._items) + len(failed)} files could not be read:"
+            for mi, error in failed[:self.REPORT_LIMIT]:
+                msg += f"\n    {mi.filename}: {error}"
+            if len(failed) > self.REPORT_LIMIT:
+                msg += f"\n    ... and {len(failed) - self.REPORT_LIMIT} more."
+            rcmp.log.warning(msg, failed=[mi.filename for mi, _ in failed])
+
+    def _describe_all(self, filenames):
+        # Parses filenames, in parallel when there are enough of them.
+        # Returns list of (MediaInfo, error) tuples in filenames order.
+        jobs = self.jobs or os.cpu_count() or 1
+        if jobs < 2 or len(filenames) < 2 * jobs:
+            return [describe(f) for f in filenames]
+        chunk = max(1, len(filenames) // (jobs * 8))
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+                return list(pool.map(describe, filenames, chunksize=chunk))
+        except (OSError, concurrent.futures.BrokenExecutor):
+            return [describe(f) for f in filenames]
+
+    def media_info(self, item=None):
+        """
+        Returns MediaInfo for item.
+
+        The information is taken from the index when the file is unchanged
+        since it was indexed, otherwise the file is compiled.
+
+            Parameters:
+                item (MediaItem): Optional, defaults to the selected item.
+
+            Returns:
+                rcmp.index.MediaInfo or None.
+        """
+        mi = item or self._current_item
+        if not mi:
+            return None
+        try:
+            stamp = rcmp.timeline.TimelineCache.stamp(mi.filename)
+        except OSError:
+            return None
+        if mi.info and mi.stamp == stamp:
+            return mi.info
+        info = None
+        if self.index:
+            info = self.index.lookup(mi.filename, stamp)
+        if not info:
+            timeline = self.cache.get(mi.filename)
+            if timeline is None:
+                return None
+            info = rcmp.index.MediaInfo.from_timeline(timeline)
+            if self.index:
+                self.index.store([(mi.filename, stamp, info)])
+        mi.stamp, mi.info = stamp, info
+        return info
+
+    def watch(self, dispatch=None):
+        """
+        Starts watching the list directory.
+
+        New, modified and deleted files are applied to the list as they 
+        happen with apply_change(), without a rescan.  Scanning another
+        directory moves the watch to it.
+
+            Parameters:
+                dispatch (function): Optional, called as dispatch(function, *args)
+                    to run each update on another thread.  Defaults to running
+                    updates on the watcher's thread.
+        """
+        self.unwatch()
+        self._dispatch = dispatch
+        if self._directory:
+            self.watcher = rcmp.watch.create_watcher(self._directory, self._on_change,
+                                                     self.recursive, self.accept)
+
+    def unwatch(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def _on_change(self, kind, filename):
+        if self._dispatch:
+            self._dispatch(self.apply_change, kind, filename)
+        else:
+            self.apply_change(kind, filename)
+
+    def apply_change(self, kind, filename):
+        """
+        Applies a single change reported by the watcher.
+
+        Only the affected items, their cached timelines and their index
+        entries are updated.
+
+            Parameters:
+                kind (str): rcmp.watch.CHANGED, REMOVED or RESCAN.
+                filename (str): Changed file, or removed file or directory.
+        """
+        if kind == rcmp.watch.RESCAN:
+            self.rescan()
+            return
+        if self._directory is None:
+            return
+        if kind == rcmp.watch.REMOVED:
+            prefix = filename + os.sep
+            removed = [mi for mi in self._items.values()
+                       if mi.filename == filename or mi.filename.startswith(prefix)]
+            for mi in removed:
+                self._remove(mi.alias)
+                self.cache.invalidate(mi.filename)
+                if mi is self._current_item:
+                    self._current_item = None
+            if self.index and removed:
+                self.index.remove([mi.filename for mi in removed])
+            self._auto_select()
+            return
+        self.cache.invalidate(filename)
+        if self.index:
+            self.index.remove([filename])
+        for mi in self._items.values():
+            if mi.filename == filename:
+                mi.stamp = mi.info = None
+                return
+        self._add_relative(self._directory, path.relpath(filename, self._directory))
+        self._auto_select()
 
     def clear(self):
         """Clears list contents."""
         self._items = {}
+        self._sorted = []
+        self._folded = []
         self._directory = None
         self._current_item = None
 
@@ -169,23 +430,80 @@ class MediaList:
             self.scan_directory(temp_directory)
             if temp_alias in self._items.keys():
                 self.select(temp_alias)
-            else:
-                alist = self.aliases
-                if len(alist):
-                    self.select(alist[0])
+            elif self._sorted:
+                self.select(self._sorted[0])
         
     @property
     def aliases(self):
         """
         Returns sorted list of MIDI file names.
         """
-        lst = list(self._items.keys())
-        lst.sort()
-        return lst
+        return list(self._sorted)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def position(self, alias):
+        """
+        Returns list-index of alias, or None if the list does not contain alias.
+        """
+        n = bisect_left(self._sorted, alias)
+        if n < len(self._sorted) and self._sorted[n] == alias:
+            return n
+        return None
+
+    def items(self, offset=0, limit=None):
+        """
+        Returns a slice of the list without copying the rest of it.
+
+            Parameters:
+                offset (int): List-index of the first item.
+                limit (int): Optional maximum number of items.
+
+            Returns:
+                List of (list-index, MediaItem) tuples.
+        """
+        end = len(self._sorted) if limit is None else offset + limit
+        return [(n, self._items[a]) for n, a in
+                enumerate(self._sorted[offset:end], offset)]
+
+    def search(self, text):
+        """
+        Finds aliases matching text, ignoring case.
+
+        Aliases starting with text are listed first, then aliases containing
+        text, then aliases containing the characters of text in order 
+        (i.e. 'vln2' matches 'violin-part-2'), closest matches first.
+
+            Parameters:
+                text (str)
+
+            Returns:
+                List of aliases.
+        """
+        key = text.lower()
+        folded = self._folded
+        n = bisect_left(folded, (key,))
+        prefix = []
+        while n < len(folded) and folded[n][0].startswith(key):
+            prefix.append(folded[n][1])
+            n += 1
+        seen = set(prefix)
+        substring = [a for f, a in folded if key in f and a not in seen]
+        seen.update(substring)
+        pattern = re.compile(".*?".join(map(re.escape, key)))
+        fuzzy = []
+        for f, a in folded:
+            if a not in seen:
+                match = pattern.search(f)
+                if match:
+                    fuzzy.append((match.end() - match.start(), a))
+        fuzzy.sort()
+        return prefix + substring + [a for _, a in fuzzy]
     
-    def select(self, alias):
+    def find(self, alias):
         """
-        Marks selected file as 'selected'.
+        Looks up a MediaItem without selecting it.
 
            Parameters:
               alias (str|int): MIDI filename alias or list-index.
@@ -193,23 +511,30 @@ class MediaList:
            Returns:
               Either a matching MediaItem or, None is list does not contain alias.
         """
-        rs = None
         try:
             n = int(alias)
-            alist = self.aliases
-            if 0 <= n < len(alist):
-                alias = alist[n]
-                self.select(alias)
+            if 0 <= n < len(self._sorted):
+                alias = self._sorted[n]
         except ValueError:
             pass
-        try:
-            mi = self._items[alias]
-            rs = self._current_item = mi
-        except KeyError:
-            msg = f"ERROR: Invalid media name: {alias}"
-            print(msg)
-        finally:
-            return rs
+        return self._items.get(alias)
+
+    def select(self, alias):
+        """
+        Marks selected file as 'selected'.
+
+           Parameters:
+              alias (str|int): MIDI filename alias or list-index.
+
+           Returns:
+              Either a matching MediaItem or, None is list does not contain alias.
+        """
+        mi = self.find(alias)
+        if mi:
+            self._current_item = mi
+        else:
+            rcmp.log.error(f"Invalid media name: {alias}")
+        return mi
 
     def midi_file(self, alias=None):
         """
@@ -228,31 +553,123 @@ class MediaList:
             try:
                 rs = self._current_item.midi_file
             except AttributeError:
-                msg = f"ERROR: No media selected."
-                print(msg)
+                rcmp.log.error("No media selected.")
         else:
             mi = self.select(alias)
             if mi:
                 rs = mi.midi_file
         return rs
     
+    def timeline(self, alias=None, stream=False):
+        """
+        Retrieves compiled Timeline for selected item.
+
+        The timeline is compiled on first use and then served from the cache
+        until the file is modified.
+
+        Parameters:
+            alias (str): Optional string.
+                If specified, alias becomes the currently selected MIDI file,
+                defaults to the currently selected MIDI file.
+            stream (bool): If True, and the timeline is not yet compiled,
+                return a rcmp.timeline.TimelineBuilder so that playback
+                may start while the file is compiled.  Files larger than
+                stream_size are not compiled at all, a rcmp.smf.SMFStream
+                is returned which plays directly from the mapped file.
+
+        Returns:
+            Either an instance of rcmp.timeline.Timeline, TimelineBuilder,
+            SMFStream or, None if no item is selected or the file can not be read.
+        """
+        mi = self._current_item
+        if alias:
+            mi = self.select(alias)
+        if not mi:
+            if not alias:
+                rcmp.log.error("No media selected.")
+            return None
+        rs = self.playable(mi, stream)
+        if rs is None:
+            rcmp.log.error(f"Either '{mi.filename}' does not exists or it is not a MIDI file.",
+                           filename=mi.filename)
+        return rs
+
+    def playable(self, mi, stream=False):
+        """
+        Returns events of MediaItem mi without selecting it, as timeline()
+        but nothing is reported.
+
+            Returns:
+                Timeline, TimelineBuilder, SMFStream or None if the file 
+                can not be read.
+        """
+        if stream and self.is_large(mi.filename) and self.cache.lookup(mi.filename) is None:
+            try:
+                return rcmp.smf.SMFStream(mi.filename)
+            except rcmp.timeline.LOAD_ERRORS:
+                return None
+        return self.preloader.fetch(mi.filename, stream)
+
+    def request(self, mi):
+        """
+        Starts background compilation of MediaItem mi, unless it is larger
+        than stream_size.
+        """
+        if not self.is_large(mi.filename):
+            self.preloader.request(mi.filename)
+
+    def is_large(self, filename):
+        """Returns True if filename is played without compiling, see stream_size."""
+        if self.stream_size is None:
+            return False
+        try:
+            return path.getsize(filename) > self.stream_size
+        except OSError:
+            return False
+
+    def preload(self):
+        """
+        Starts background compilation of the selected item.
+
+        If preload_ahead is greater than 0, that many of the following items
+        in the list are also preloaded.  Files larger than stream_size are
+        not preloaded.
+        """
+        mi = self._current_item
+        if not mi:
+            return
+        items = [mi]
+        if self.preload_ahead:
+            n = self.position(mi.alias)
+            for alias in self._sorted[n+1:n+1+self.preload_ahead]:
+                items.append(self._items[alias])
+        for mi in items:
+            self.request(mi)
+
+    def row(self, mi):
+        """
+        Returns single line listing of MediaItem mi, as displayed by dump(). 
+        """
+        n = self.position(mi.alias)
+        header = "*" if mi is self._current_item else " "
+        return f"[{n:2d}] {header} {mi}"
+
     def dump(self):
         """Displays list contents."""
-        print("MediaList")
-        print(f"Directory : {self._directory}")
-        for n, a in enumerate(self.aliases):
-            print("[{n:2d}] ".format(n=n), end="")
+        rcmp.log.console("MediaList")
+        rcmp.log.console(f"Directory : {self._directory}")
+        current = self._current_item
+        for n, a in enumerate(self._sorted):
             mi = self._items[a]
-            header = " " 
-            if mi is self._current_item:
-                header = "*"
-            print(f"{header} {mi}")
+            header = "*" if mi is current else " "
+            rcmp.log.console(f"[{n:2d}] {header} {mi}")
 
     def selected_file_info(self):
         s = f"MIDI File: {self._current_item.filename}\n"
-        mf = self.midi_file()
-        if mf:
-            s += f"Length {mf.length} seconds."
+        info = self.media_info()
+        if info:
+            s += f"{info}\n"
+        s += str(self.preloader)
         return s
             
     def __str__(self):
@@ -0,0 +1,71 @@
+# rcmp.merge
+#
+# Streaming k-way merge of MIDI tracks.
+#
+# mido.merge_tracks() copies every message of every track into a single
+# list and sorts it before the first event is available.  merge_tracks()
+# here keeps one pending message per track in a heap, so the first event
+# is produced immediately and the extra memory is proportional to the
+# number of tracks rather than the number of events.
+#
+
+import heapq
+import mido
+
+
+DEFAULT_TEMPO = 500000
+
+
+def merge_tracks(tracks):
+    """
+    Lazily interleaves tracks in time order.
+
+    Simultaneous events are produced in track order, matching
+    mido.merge_tracks().
+
+        Parameters:
+            tracks (list): Of mido.MidiTrack, or any iterables of messages
+                with delta times in ticks.
+
+        Yields:
+            tuple (absolute_tick, message)
+    """
+    heap = []
+    for index, track in enumerate(tracks):
+        it = iter(track)
+        for msg in it:
+            heap.append((msg.time, index, msg, it))
+            break
+    heapq.heapify(heap)
+    while heap:
+        tick, index, msg, it = heap[0]
+        yield tick, msg
+        for nxt in it:
+            heapq.heapreplace(heap, (tick + nxt.time, index, nxt, it))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def merge_events(tracks, ticks_per_beat):
+    """
+    Lazily interleaves tracks, applying tempo changes as they occur.
+
+        Parameters:
+            tracks (list): Of mido.MidiTrack.
+            ticks_per_beat (int)
+
+        Yields:
+            tuple (absolute_tick, seconds, message) for every message,
+            including meta messages.
+    """
+    tempo = DEFAULT_TEMPO
+    last_tick = 0
+    seconds = 0.0
+    for tick, msg in merge_tracks(tracks):
+        if tick != last_tick:
+            seconds += mido.tick2second(tick - last_tick, ticks_per_beat, tempo)
+            last_tick = tick
+        yield tick, seconds, msg
+        if msg.type == "set_tempo":
+            tempo = msg.tempo
@@ -4,6 +4,9 @@
 
 import argparse
 import os.path
+import rcmp.log
+import rcmp.panic
+import rcmp.precision
 
 def create_argparse():
     parser = argparse.ArgumentParser(description="Play MIDI files under OSC control.")
@@ -17,8 +20,10 @@ def create_argparse():
     parser.add_argument("-b", "--backend", type=str, default="mido.backends.portmidi",
                         help="Set MIDI backend, see documentation for mido.")
 
-    parser.add_argument("-o", "--out", type=str, default="0",
-                        help="Select MIDI output, either by name or number.")
+    parser.add_argument("-o", "--out", type=str, action="append", default=None,
+                        help="Select MIDI output, either by name or number. May be repeated to play to several outputs.")
+    parser.add_argument("-L", "--layer", type=str, action="append", default=None,
+                        help="Add an independent playback layer on MIDI output, either by name or number. May be repeated.")
 
     parser.add_argument("--port", type=int, default=7000,
                         help="Set OSC port number.")
@@ -29,9 +34,59 @@ def create_argparse():
     parser.add_argument("--ip", type=str, default="127.0.0.1",
                         help="OSC ip address")
 
+    parser.add_argument("--reset", type=str, default=rcmp.panic.CONTROLLERS,
+                        choices=rcmp.panic.STRATEGIES,
+                        help="MIDI reset strategy used after each file and on exit.")
+
+    parser.add_argument("--reset-rate", type=int, default=rcmp.panic.DIN_BYTE_RATE,
+                        help=("Byte rate used to pace reset messages, 0 disables pacing.  "
+                              "A full reset takes about 2 seconds at the default rate."))
+
+    parser.add_argument("--cache-size", type=int, default=64,
+                        help="Maximum memory used by compiled MIDI files, in megabytes.")
+
+    parser.add_argument("--stream-size", type=int, default=8,
+                        help="Files larger than this, in megabytes, are played directly from disk instead of being compiled. 0 disables.")
+
+    parser.add_argument("-r", "--recursive", default=False, action="store_true",
+                        help="Include MIDI files in nested subdirectories.")
+
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of processes used to parse MIDI files while scanning, defaults to cpu count.")
+
+    parser.add_argument("-w", "--watch", default=False, action="store_true",
+                        help="Update the media-list as MIDI files are added, modified or removed.")
+
+    parser.add_argument("--index", type=str, default=None,
+                        help="Media index file, defaults to ~/.cache/rcmp/index.sqlite3")
+
+    parser.add_argument("--no-index", default=False, action="store_true",
+                        help="Do not use a persistent media index.")
+
+    parser.add_argument("--preload-next", default=False, action="store_true",
+                        help="When a file is selected, also preload the next file in the list.")
+
     parser.add_argument("-x", "--exit", default=False, action="store_true",
                         help="Exit program after playing file,  exit only makes sense when --play option is present.")
 
+    parser.add_argument("--precision", default=False, action="store_true",
+                        help="Spin-wait before each event and hold off garbage collection while playing.")
+
+    parser.add_argument("--spin", type=float, default=rcmp.precision.SPIN_MARGIN * 1000,
+                        help="Milliseconds spent spin-waiting before each event in precision mode.")
+
+    parser.add_argument("--realtime", default=False, action="store_true",
+                        help="In precision mode, request real-time scheduling priority while playing.")
+
+    parser.add_argument("--log-level", default="info", choices=list(rcmp.log.LEVELS),
+                        help="Minimum level of messages written to the console and log file.")
+
+    parser.add_argument("--log-file", default=None,
+                        help="Append log messages to this file as JSON lines.")
+
+    parser.add_argument("--startup-profile", default=False, action="store_true",
+                        help="Print the time taken by each startup step.")
+
     parser.add_argument("-p", "--play", default=False, action="store_true",
                         help="Start playback of initial file immediately.")
     return parser
@@ -1,79 +1,297 @@
 # rcmp oschandler
 
-import pyOSC3
 import sys
+import pyOSC3
 import rcmp.docs
+import rcmp.log
+import rcmp.asyncosc
+
+
+PAGE_SIZE = 20        # Items per reply page.
+MAX_PAGE_SIZE = 100   # Largest page a client may ask for, keeps replies in one datagram.
 
 class OSCHandler:
 
     def __init__(self, app):
         self.app = app
         adr = (app.osc_ip, app.osc_port)
-        self.server = pyOSC3.OSCServer(adr)
+        self.server = rcmp.asyncosc.AsyncOSCServer(adr)
         self.register("exit", self.exit_callback)
         self.register("play", self.play_callback)
         self.register("stop", self.stop_callback)
         self.register("list", self.media_list_callback)
         self.register("info", self.info_callback)
         self.register("select", self.select_callback)
+        self.register("find", self.find_callback)
         self.register("scan", self.scan_callback)
+        self.register("seek", self.seek_callback)
+        self.register("tempo", self.tempo_callback)
+        self.register("queue", self.queue_callback)
+        self.register("unqueue", self.unqueue_callback)
+        self.register("next", self.next_callback)
+        self.register("timing", self.timing_callback)
+        self.register("stats", self.stats_callback)
+        self.register("voices", self.voices_callback)
+        self.register("outputs", self.outputs_callback)
+        self.register("layers", self.layers_callback)
+        for layer in app.layers.layers:
+            self.register_layer(str(layer.number), [layer])
+        if app.layers.layers:
+            self.register_layer("all", app.layers.layers)
         self.register("help", self.help_callback)
         
     def register(self, command, callback):
         adr = f"{self.app.osc_prefix}/{command}"
         self.server.addMsgHandler(adr, callback)
         
+    def register_layer(self, name, layers):
+        # Registers /layer/<name>/... commands acting on list of layers.
+        mixer = self.app.layers
+
+        def select_callback(*args):
+            if len(layers) != 1 or not args[2]:
+                rcmp.log.error("/layer/N/select expects a single layer and a name.")
+            elif mixer.select(layers[0], args[2][0]):
+                rcmp.log.console(layers[0])
+            else:
+                rcmp.log.error(f"Invalid media name: {args[2][0]}")
+            self.app.print_prompt()
+
+        def play_callback(*args):
+            for layer in mixer.play(layers):
+                rcmp.log.console(f"Layer {layer.number} play")
+            self.app.print_prompt()
+
+        def stop_callback(*args):
+            for layer in layers:
+                mixer.stop(layer)
+            rcmp.log.console(f"Layer {name} stop")
+            self.app.print_prompt()
+
+        self.register(f"layer/{name}/select", select_callback)
+        self.register(f"layer/{name}/play", play_callback)
+        self.register(f"layer/{name}/stop", stop_callback)
+
+    @staticmethod
+    def _range(args, total, first=0):
+        # Returns (offset, limit) from optional arguments at positions first
+        # and first + 1, clipped to total and MAX_PAGE_SIZE.
+        values = []
+        for n, default in ((first, 0), (first + 1, PAGE_SIZE)):
+            try:
+                values.append(max(0, int(args[2][n])))
+            except (IndexError, ValueError):
+                values.append(default)
+        offset, limit = values
+        return min(offset, total), min(limit, MAX_PAGE_SIZE)
+
+    def send_rows(self, client, command, header, rows):
+        """
+        Replies with an OSC bundle holding <prefix>/<command>/page with the
+        header values, then one <prefix>/<command>/item message per row.
+
+            Parameters:
+                client (tuple): (ip, port) of the sender.
+                command (str)
+                header (tuple): Arguments of the page message.
+                rows (list): Of tuples, the arguments of each item message.
+        """
+        address = f"{self.app.osc_prefix}/{command}"
+        bundle = pyOSC3.OSCBundle()
+        msg = pyOSC3.OSCMessage(f"{address}/page")
+        for value in header:
+            msg.append(value)
+        bundle.append(msg)
+        for row in rows:
+            msg = pyOSC3.OSCMessage(f"{address}/item")
+            for value in row:
+                msg.append(value)
+            bundle.append(msg)
+        self.server.sendto(bundle, client)
+
     def exit_callback(self, *args):
         self.app.stop_signal = True
         self.app.exit_signal = True
 
     def play_callback(self, *args):
         self.app.stop_signal = False
-        print("play")
+        rcmp.log.console("play")
         self.app.print_prompt()
 
     def stop_callback(self, *args):
         self.app.stop_signal = True
-        print("Stop")
+        rcmp.log.console("Stop")
         self.app.print_prompt()
 
     def media_list_callback(self, *args):
-        self.app.media_list.dump()
-        print()
+        # Replies with a range of the media-list.  Only metadata which is
+        # already known is included, no file is read.
+        media_list = self.app.media_list
+        total = len(media_list)
+        offset, limit = self._range(args, total)
+        current = media_list.current_item
+        rows = []
+        for n, mi in media_list.items(offset, limit):
+            duration = mi.info.duration if mi.info else -1.0
+            rows.append((n, mi.alias, int(mi is current), duration))
+        self.send_rows(args[3], "list", (offset, len(rows), total), rows)
+        rcmp.log.console(f"List {offset}..{offset + len(rows)} of {total}")
+        for n, alias, selected, _ in rows:
+            header = "*" if selected else " "
+            rcmp.log.console(f"[{n:2d}] {header} {alias}")
         self.app.print_prompt()
 
     def info_callback(self, *args):
-        print("Info")
-        print(f"MIDI Output: '{self.app.midi_output_name}'")
-        print(self.app.media_list.selected_file_info())
-        print()
+        # Replies with details of the selected file, or of the file given
+        # as argument.  Metadata comes from the item or the index, the file
+        # is compiled only if neither knows it.
+        media_list = self.app.media_list
+        if args[2]:
+            mi = media_list.find(args[2][0])
+        else:
+            mi = media_list.current_item
+        msg = pyOSC3.OSCMessage(f"{self.app.osc_prefix}/info")
+        if mi is None:
+            rcmp.log.error(f"/info: No such media: {args[2][0] if args[2] else 'none selected'}")
+        else:
+            info = media_list.media_info(mi)
+            for value in (media_list.position(mi.alias), mi.alias, mi.filename):
+                msg.append(value)
+            if info:
+                for value in info.as_tuple():
+                    msg.append(value)
+            rcmp.log.console("Info")
+            rcmp.log.console(f"MIDI Output: '{self.app.midi_output_name}'")
+            rcmp.log.console(f"MIDI File: {mi.filename}")
+            if info:
+                rcmp.log.console(info)
+            if mi is media_list.current_item:
+                rcmp.log.console(media_list.preloader)
+            rcmp.log.console()
+        self.server.sendto(msg, args[3])
         self.app.print_prompt()
               
+    def seek_callback(self, *args):
+        try:
+            seconds = float(args[2][0])
+        except (IndexError, ValueError):
+            rcmp.log.error("/seek expects position in seconds.")
+            self.app.print_prompt()
+            return
+        rcmp.log.console(f"Seek {seconds}")
+        self.app.seek(seconds)
+        self.app.print_prompt()
+
+    def tempo_callback(self, *args):
+        if args[2]:
+            try:
+                self.app.set_tempo(args[2][0])
+            except ValueError:
+                rcmp.log.error(f"Invalid tempo factor: {args[2][0]}")
+        line = f"Tempo factor {self.app.scheduler.factor:.4f}"
+        position = self.app.position
+        if position is not None:
+            line += f"  position {position:.3f} seconds"
+        rcmp.log.console(line)
+        self.app.print_prompt()
+
+    def queue_callback(self, *args):
+        for alias in args[2]:
+            mi = self.app.queue(alias)
+            if mi:
+                rcmp.log.console(f"Queue '{mi.alias}'")
+        rcmp.log.console("Queue: " + " ".join(mi.alias for mi in self.app.play_queue))
+        self.app.print_prompt()
+
+    def unqueue_callback(self, *args):
+        self.app.play_queue.clear()
+        rcmp.log.console("Queue cleared")
+        self.app.print_prompt()
+
+    def next_callback(self, *args):
+        if not self.app.next():
+            rcmp.log.console("Queue empty")
+        self.app.print_prompt()
+
+    def timing_callback(self, *args):
+        rcmp.log.console(self.app.timing_stats)
+        rcmp.log.console()
+        self.app.print_prompt()
+
+    def stats_callback(self, *args):
+        # Replies to the sender, or to the port given as argument, 
+        # nothing is printed.
+        client = args[3]
+        if args[2]:
+            try:
+                client = (client[0], int(args[2][0]))
+            except ValueError:
+                pass
+        bundle = self.app.telemetry.bundle(self.app.osc_prefix)
+        self.server.sendto(bundle, client)
+
+    def outputs_callback(self, *args):
+        rcmp.log.console(self.app.midi_output_port)
+        rcmp.log.console()
+        self.app.print_prompt()
+
+    def layers_callback(self, *args):
+        rcmp.log.console(self.app.layers)
+        rcmp.log.console()
+        self.app.print_prompt()
+
+    def voices_callback(self, *args):
+        rcmp.log.console(self.app.voices)
+        rcmp.log.console()
+        self.app.print_prompt()
+
     def select_callback(self, *args):
         alias = args[2][0]
-        print(f"Select '{alias}'")
-        self.app.media_list.select(alias)
-        self.app.media_list.dump()
+        rcmp.log.console(f"Select '{alias}'")
+        media_list = self.app.media_list
+        mi = media_list.select(alias)
+        if mi:
+            media_list.preload()
+            rcmp.log.console(media_list.row(mi))
         self.app.print_prompt()
         
+    def find_callback(self, *args):
+        if not args[2]:
+            rcmp.log.error("/find expects search text.")
+            self.app.print_prompt()
+            return
+        text = str(args[2][0])
+        media_list = self.app.media_list
+        matches = media_list.search(text)
+        offset, limit = self._range(args, len(matches), 1)
+        rows = [(media_list.position(alias), alias) for alias in matches[offset:offset + limit]]
+        self.send_rows(args[3], "find", (text, offset, len(rows), len(matches)), rows)
+        rcmp.log.console(f"Find '{text}'  {len(matches)} matches")
+        for n, alias in rows:
+            rcmp.log.console(f"[{n:2d}]  {alias}")
+        self.app.print_prompt()
+
     def scan_callback(self, *args):
         directory = args[2][0]
-        print(f"Scanning directory '{directory}'")
-        self.app.media_list.clear()
-        self.app.media_list.scan_directory(directory)
-        self.app.media_list.dump()
+        rcmp.log.console(f"Scanning directory '{directory}'")
+        media_list = self.app.media_list
+        media_list.scan_directory(directory)
+        rcmp.log.console(f"{len(media_list)} files")
+        if media_list.current_item:
+            rcmp.log.console(media_list.row(media_list.current_item))
         self.app.print_prompt()
 
     def help_callback(self, *args):
-        print()
-        print(rcmp.docs.OSC_COMMANDS)
+        rcmp.log.console()
+        rcmp.log.console(rcmp.docs.OSC_COMMANDS)
         self.app.print_prompt()
         
-    def poll(self):
+    def serve(self):
+        """Handles OSC messages until close() is called."""
         if self.server:
-            self.server.handle_request()
+            self.server.serve_forever()
 
     def close(self):
-        self.server.close()
-        self.server = None
+        if self.server:
+            self.server.close()
         
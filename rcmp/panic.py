@@ -0,0 +1,167 @@
+# rcmp.panic
+#
+# Defines Panic class, MIDI reset strategies.
+#
+#   full   System reset, modulation, hold, all-notes-off and volume
+#          controllers, then an explicit note_off for every key on every
+#          channel.  Over 2000 messages, about 2 seconds at DIN_BYTE_RATE.
+#   cc     All-sound-off (CC 120) and all-notes-off (CC 123) on every channel.
+#   notes  note_off only for the notes which are actually sounding, as
+#          recorded by rcmp.voices.VoiceTable.
+#
+# Every strategy first lifts the sustain pedals and releases the notes passed
+# to Panic.send().  Messages are encoded once, as raw bytes, and sent with the
+# port's send_bytes() in batches paced against the byte rate of the MIDI link,
+# so the receiver's input buffer is not overrun.
+#
+# No mido Messages are built, so rcmp.options, which reads the constants
+# below, stays cheap to import.
+#
+
+import time
+
+
+FULL = "full"
+CONTROLLERS = "cc"
+NOTES = "notes"
+STRATEGIES = (FULL, CONTROLLERS, NOTES)
+
+DIN_BYTE_RATE = 3125   # MIDI 1.0 DIN link, 31250 baud, 10 bits per byte.
+
+
+_RESET = b"\xff"
+_NOTE_OFF_VELOCITY = 64    # mido's default note_off velocity.
+
+
+def _controller(channel, controller, value):
+    return bytes((0xB0 | channel, controller, value))
+
+
+def _note_off(channel, key):
+    return bytes((0x80 | channel, key, _NOTE_OFF_VELOCITY))
+
+
+def _full_sweep():
+    acc = [_RESET]
+    for c in range(0, 16):
+        acc.append(_controller(c, 1, 0))     # reset modulation wheel
+        acc.append(_controller(c, 69, 0))    # hold 2 off
+        acc.append(_controller(c, 123, 127)) # all notes off
+        acc.append(_controller(c, 7, 127))   # volume
+        for key in range(0, 128):
+            acc.append(_note_off(c, key))
+    return acc
+
+
+def _controller_sweep():
+    acc = []
+    for c in range(0, 16):
+        acc.append(_controller(c, 120, 0))
+        acc.append(_controller(c, 123, 0))
+    return acc
+
+
+class Panic:
+
+    """Silences a MIDI output using one of STRATEGIES."""
+
+    _sweeps = {}   # strategy -> list of encoded messages, shared by all instances.
+
+    def __init__(self, strategy=CONTROLLERS, byte_rate=DIN_BYTE_RATE, batch_bytes=48):
+        """
+        Constructs new instance of Panic.
+
+            Parameters:
+                strategy (str): One of STRATEGIES, default 'cc'.
+                byte_rate (int): Bytes per second the output link can carry.
+                    0 sends everything without pacing.
+                batch_bytes (int): Approximate size of each batch, the pacing
+                    delay is applied between batches.
+
+            Raises ValueError if strategy is invalid.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Invalid reset strategy: '{strategy}'")
+        self.strategy = strategy
+        self.byte_rate = byte_rate
+        self.batch_bytes = batch_bytes
+        self.duration = 0.0    # seconds taken by the most recent send.
+        self._sweep = self._batch(self._fixed_messages(strategy))
+
+    @classmethod
+    def _fixed_messages(cls, strategy):
+        if strategy not in cls._sweeps:
+            if strategy == FULL:
+                cls._sweeps[strategy] = _full_sweep()
+            elif strategy == CONTROLLERS:
+                cls._sweeps[strategy] = _controller_sweep()
+            else:
+                cls._sweeps[strategy] = []
+        return cls._sweeps[strategy]
+
+    def _batch(self, messages):
+        # Returns list of (messages, byte_count) tuples, messages are bytes.
+        acc = []
+        batch = []
+        count = 0
+        for data in messages:
+            batch.append(data)
+            count += len(data)
+            if count >= self.batch_bytes:
+                acc.append((batch, count))
+                batch = []
+                count = 0
+        if batch:
+            acc.append((batch, count))
+        return acc
+
+    @staticmethod
+    def note_offs(notes):
+        """
+        Returns list of encoded note_off messages.
+
+            Parameters:
+                notes (iterable): Of (channel, key) tuples.
+        """
+        return [_note_off(c, k) for c, k in notes]
+
+    def send(self, port, notes=(), pedals=(), sweep=True):
+        """
+        Sends reset messages to port.
+
+            Parameters:
+                port (rcmp.fanout.FanOut): Any output with send_bytes(data).
+                notes (iterable): Optional (channel, key) tuples of notes
+                    known to be sounding, these are released first.
+                pedals (iterable): Optional channels with the sustain pedal
+                    down, the pedal is lifted before notes are released.
+                sweep (bool): If False, only release notes and pedals, and 
+                    skip the strategy's own messages.
+
+            Returns:
+                Elapsed time in seconds.
+        """
+        release = [_controller(c, 64, 0) for c in pedals]
+        release += self.note_offs(notes)
+        batches = self._batch(release)
+        if sweep:
+            batches += self._sweep
+        send_bytes = port.send_bytes
+        start = time.perf_counter()
+        sent = 0
+        for messages, count in batches:
+            if sent and self.byte_rate:
+                # Waits until the link has carried the previous batches, 
+                # paced against the start of the reset, not the previous 
+                # batch.  Nothing is waited for after the final batch.
+                delay = start + sent / self.byte_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            for data in messages:
+                send_bytes(data)
+            sent += count
+        self.duration = time.perf_counter() - start
+        return self.duration
+
+    def __str__(self):
+        return f"Panic strategy: {self.strategy}  byte rate: {self.byte_rate}"
@@ -0,0 +1,123 @@
+# rcmp.precision
+#
+# Defines Precision class, the opt-in precision playback mode.
+#
+# Three sources of jitter remain once events are played against absolute
+# deadlines:
+#
+#   sleep    time.sleep and Event.wait may return a fraction of a
+#            millisecond, or on some systems several milliseconds, late.
+#            In precision mode the scheduler sleeps until SPIN_MARGIN
+#            before each deadline and busy-waits the rest.
+#   gc       a cyclic garbage collection may start at any allocation.  In
+#            precision mode the heap is frozen when playback starts and the
+#            collector is disabled while playing.  Garbage is collected
+#            when playback ends, and objects created while playing are
+#            collected during the tail of each queued file, so no
+#            collection delays the start of a file.
+#   priority other processes may be scheduled ahead of the player.  With
+#            realtime enabled the playback thread requests SCHED_FIFO
+#            while playing, where the OS and permissions allow it.
+#
+# The resulting lateness and jitter are reported by /rcmp/timing and
+# /rcmp/stats, and bench.py plays the same files with and without
+# precision mode.
+#
+
+import gc
+import os
+import rcmp.log
+
+
+SPIN_MARGIN = 0.0005    # seconds busy-waited before each deadline.
+REALTIME_PRIORITY = 10  # SCHED_FIFO priority, low enough not to starve the kernel's own threads.
+
+
+class Precision:
+
+    """Applies precision mode around playback runs."""
+
+    def __init__(self, enabled=False, spin=SPIN_MARGIN, realtime=False):
+        """
+        Constructs new instance of Precision.
+
+            Parameters:
+                enabled (bool): If False begin(), between() and end() do nothing.
+                spin (float): Seconds busy-waited before each deadline.
+                realtime (bool): If True request real-time scheduling while playing.
+        """
+        self.enabled = enabled
+        self.spin = spin
+        self.realtime = realtime
+        self._gc_enabled = None     # collector state before begin(), None when not playing.
+        self._previous_policy = None
+
+    def configure(self, scheduler):
+        """Sets scheduler's spin margin."""
+        scheduler.spin = self.spin if self.enabled else 0.0
+
+    def begin(self):
+        """
+        Prepares the calling thread for playback.  Must be followed by end().
+        """
+        if not self.enabled or self._gc_enabled is not None:
+            return
+        self._gc_enabled = gc.isenabled()
+        gc.freeze()
+        gc.disable()
+        if self.realtime:
+            self._raise_priority()
+
+    def between(self):
+        """Collects garbage created since begin(), called between files."""
+        if self._gc_enabled is not None:
+            gc.collect()
+
+    def end(self):
+        """
+        Restores collector and scheduling priority, and collects the garbage
+        held over while playing.
+        """
+        if self._gc_enabled is None:
+            return
+        self._restore_priority()
+        gc.unfreeze()
+        gc.collect()
+        if self._gc_enabled:
+            gc.enable()
+        self._gc_enabled = None
+
+    def _raise_priority(self):
+        # Disables realtime after the first failure so the warning is
+        # reported once.
+        if not hasattr(os, "sched_setscheduler"):
+            rcmp.log.warning("Real-time priority is not supported on this platform.")
+            self.realtime = False
+            return
+        try:
+            previous = (os.sched_getscheduler(0), os.sched_getparam(0))
+            priority = min(REALTIME_PRIORITY, os.sched_get_priority_max(os.SCHED_FIFO))
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except OSError as err:
+            rcmp.log.warning(f"Can not set real-time priority: {err}")
+            self.realtime = False
+            return
+        self._previous_policy = previous
+
+    def _restore_priority(self):
+        if self._previous_policy is None:
+            return
+        policy, param = self._previous_policy
+        self._previous_policy = None
+        try:
+            os.sched_setscheduler(0, policy, param)
+        except OSError as err:
+            rcmp.log.warning(f"Can not restore scheduling priority: {err}")
+
+    def __str__(self):
+        if not self.enabled:
+            return "Precision  off"
+        acc = f"Precision  spin: {self.spin * 1000:g} ms  gc: frozen while playing"
+        if self.realtime:
+            acc += "  real-time priority"
+        return acc
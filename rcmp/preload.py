@@ -0,0 +1,131 @@
+# rcmp.preload
+#
+# Defines Preloader class.
+#
+# Compiles MIDI files into a TimelineCache on a background thread so that
+# parse and disk latency is paid when a file is selected rather than
+# immediately before its first note.
+#
+
+import queue
+import threading
+import time
+import rcmp.log
+
+
+class Preloader:
+
+    """Background worker which compiles timelines ahead of playback."""
+
+    FETCH_TIMEOUT = 30.0   # seconds fetch() waits for a background compile.
+
+    def __init__(self, cache):
+        """
+        Constructs new instance of Preloader.
+
+            Parameters:
+                cache (rcmp.timeline.TimelineCache): Compiled timelines are
+                    stored in cache.
+        """
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._pending = {}     # filename -> threading.Event, set when compiled.
+        self._lock = threading.Lock()
+        self._thread = None
+        self.hits = 0          # fetched timeline was already compiled.
+        self.waits = 0         # fetched timeline was still being compiled.
+        self.misses = 0        # fetched timeline had to be compiled on demand.
+        self.last = None       # outcome of most recent fetch.
+
+    def request(self, filename):
+        """
+        Queues filename for background compilation.
+
+        The request is ignored if filename is already cached or queued.
+        """
+        if self.cache.lookup(filename) is not None:
+            return
+        self._submit(filename, None)
+
+    def finish(self, builder):
+        """
+        Queues an abandoned rcmp.timeline.TimelineBuilder, the rest of its
+        file is compiled in the background and added to the cache.
+        """
+        self._submit(builder.filename, builder)
+
+    def _submit(self, filename, builder):
+        with self._lock:
+            if filename in self._pending:
+                return
+            self._pending[filename] = threading.Event()
+            if not self._thread:
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+        self._queue.put((filename, builder))
+
+    def _worker(self):
+        while True:
+            filename, builder = self._queue.get()
+            try:
+                if builder is None:
+                    self.cache.get(filename)
+                else:
+                    builder.finish()
+            except Exception as err:
+                # A file which breaks the parser must not stop the worker.
+                rcmp.log.error(f"Can not preload '{filename}': {err!r}", filename=filename)
+            finally:
+                with self._lock:
+                    ready = self._pending.pop(filename, None)
+                if ready:
+                    ready.set()
+
+    def is_pending(self, filename):
+        return filename in self._pending
+
+    def fetch(self, filename, stream=False):
+        """
+        Returns compiled Timeline for filename.
+
+        If filename is being compiled in the background, waits for it to
+        complete instead of parsing it a second time.  If the worker has
+        stopped, or the compile takes longer than FETCH_TIMEOUT, the file is
+        compiled on the calling thread.
+
+            Parameters:
+                filename (str)
+                stream (bool): If True and filename is neither compiled nor
+                    being compiled, return a TimelineBuilder whose events
+                    can be played while the file is compiled.  If playback
+                    stops early the builder is finished in the background.
+
+            Returns:
+                Timeline, TimelineBuilder or None if filename is not a
+                readable MIDI file.
+        """
+        with self._lock:
+            ready = self._pending.get(filename)
+        if ready:
+            deadline = time.monotonic() + self.FETCH_TIMEOUT
+            while not ready.wait(0.1):
+                if not self._thread.is_alive() or time.monotonic() > deadline:
+                    break
+            self.waits += 1
+            self.last = "wait"
+        elif self.cache.lookup(filename) is not None:
+            self.hits += 1
+            self.last = "hit"
+        else:
+            self.misses += 1
+            self.last = "miss"
+            if stream:
+                builder = self.cache.stream(filename)
+                if builder is not None:
+                    builder.on_abandon = self.finish
+                return builder
+        return self.cache.get(filename)
+
+    def __str__(self):
+        return (f"Preload  hits: {self.hits}  waits: {self.waits}  misses: {self.misses}"
+                f"  last: {self.last}")
@@ -1,20 +1,28 @@
 # rcmp.rcmp
 
+from collections import deque
 import os.path
+import sqlite3
 import sys
-from threading import Thread
-import time
+from threading import Event, Thread, current_thread
 import mido
 import rcmp.media
+import rcmp.index
+import rcmp.log
 import rcmp.options
-import rcmp.oschandler
-import rcmp.docs
+import rcmp.scheduler
+import rcmp.panic
+import rcmp.precision
+import rcmp.voices
+import rcmp.fanout
+import rcmp.layers
+import rcmp.telemetry
 
 
 class Rcmp:
 
     def __init__(self):
-        self._osc_poll_thread = None
+        self._osc_thread = None
         self._osc_handler = None
         self._midi_backend = None
         self._midi_output_name = None
@@ -23,9 +31,23 @@ class Rcmp:
         self._osc_port = None
         self._osc_prefix = None
         self._auto_exit = False
-        self.stop_signal = True
-        self.exit_signal = False
+        self._stop_signal = True
+        self._exit_signal = False
+        self._wake_event = Event()    # set when playback or exit is requested.
+        self._halt_event = Event()    # set when stop or exit is requested.
+        self._play_request_time = None
+        self._seek_request = None       # seconds, start of next play.
+        self._skip_request = False
+        self.play_queue = deque()       # of MediaItem
+        self.events_sent = 0            # total events played, all runs.
         self.media_list = rcmp.media.MediaList(self)
+        self.scheduler = rcmp.scheduler.Scheduler()
+        self.precision = rcmp.precision.Precision()
+        self.panic = rcmp.panic.Panic()
+        self.voices = rcmp.voices.VoiceTable()
+        self.layers = rcmp.layers.LayerMixer(self.media_list, self.panic,
+                                             self.scheduler.clock)
+        self.telemetry = rcmp.telemetry.Telemetry(self, self.scheduler.clock)
         
     @property
     def midi_backend(self):
@@ -47,70 +69,279 @@ class Rcmp:
     def osc_port(self):
         return self._osc_port
 
+    @property
+    def osc_server(self):
+        if self._osc_handler:
+            return self._osc_handler.server
+        return None
+
     @property
     def osc_prefix(self):
         return self._osc_prefix
 
-    def _osc_poll_callback(self, *args):
-        while not self.exit_signal:
-            self._osc_handler.poll()
+    @property
+    def stop_signal(self):
+        return self._stop_signal
 
-    def _start_osc_poll_loop(self):
-        if not self._osc_poll_thread:
-            self._osc_poll_thread = Thread(target=self._osc_poll_callback, daemon=True)
-            self._osc_poll_thread.start()
+    @stop_signal.setter
+    def stop_signal(self, flag):
+        """
+        Setting stop_signal False requests playback and wakes the idle loop.
+        Setting it True aborts any pending wait in the playback loop.
+        """
+        self._stop_signal = flag
+        if flag:
+            self._halt_event.set()
+        else:
+            self._halt_event.clear()
+            self._play_request_time = self.scheduler.clock()
+            self._wake_event.set()
+
+    @property
+    def exit_signal(self):
+        return self._exit_signal
+
+    @exit_signal.setter
+    def exit_signal(self, flag):
+        self._exit_signal = flag
+        if flag:
+            self._halt_event.set()
+            self._wake_event.set()
+
+    @property
+    def timing_stats(self):
+        """Returns LatenessStats for the most recent playback run."""
+        return self.scheduler.stats
+
+    def _start_osc_server(self):
+        if not self._osc_thread:
+            self._osc_thread = Thread(target=self._osc_handler.serve, daemon=True)
+            self._osc_thread.start()
 
     def print_prompt(self):
-        print(f"{self.osc_prefix} : ", end = "", flush = True)
+        rcmp.log.console(f"{self.osc_prefix} : ", end="")
             
     def midi_reset(self):
+        """
+        Silences the MIDI output using the configured reset strategy.
 
-        def controller(channel, controller, value):
-            msg = mido.Message("control_change", channel=channel, control=controller, value=value)
-            self._midi_output_port.send(msg)
-            
-        self._midi_output_port.send(mido.Message("reset"))
-        for c in range(0, 16):
-            controller(c, 1, 0)     # reset modulation wheel
-            controller(c, 69, 0)    # sustain pedal off
-            controller(c, 123, 127) # all notes off
-            controller(c, 7, 127)   # volume
-            for key in range(0, 128):
-                msg = mido.Message("note_off", channel=c, note=key)
-                self._midi_output_port.send(msg)
-                if key % 10 == 0:
-                    time.sleep(0.001)
+        Notes recorded as sounding in self.voices are released first, and
+        the table is cleared.
+        """
+        if self._midi_output_port:
+            self.panic.send(self._midi_output_port, self.voices.sounding(), self.voices.pedals())
+        self.voices.clear()
+
+    def seek(self, seconds):
+        """
+        Sets playback position.
+
+        If a file is playing, playback continues from the new position,
+        otherwise the next play starts from it.
+
+            Parameters:
+                seconds (float): Position from start of file.
+        """
+        self._seek_request = max(0.0, float(seconds))
+        if not self.stop_signal:
+            self._halt_event.set()
+
+    # Restores the controller state at a seek position.
+    # Returns the index of the first event to play.
+    def _chase(self, timeline, seconds):
+        index, state = timeline.chase_index.seek(seconds)
+        for data in state.messages():
+            self._midi_output_port.send_bytes(data)
+            self.voices.update(data)
+        return index
+
+    def queue(self, alias):
+        """
+        Appends a media-list item to the play queue.
+
+        The file is compiled in the background, unless it is larger than
+        --stream-size.  When the current file ends it starts on the same
+        clock, without a reset in between.
+
+            Parameters:
+                alias (str|int): MIDI filename alias or list-index.
+
+            Returns:
+                The queued MediaItem or None if alias is invalid.
+        """
+        mi = self.media_list.find(alias)
+        if mi:
+            self.play_queue.append(mi)
+            self.media_list.request(mi)
+        else:
+            rcmp.log.error(f"Invalid media name: {alias}")
+        return mi
+
+    def next(self):
+        """
+        Skips to the next queued item.
+
+        If a file is playing, the next queued item starts immediately,
+        otherwise it is selected for the next play.
+
+            Returns:
+                False if the queue is empty.
+        """
+        if not self.play_queue:
+            return False
+        if self.stop_signal:
+            self.media_list.select(self.play_queue.popleft().alias)
+        else:
+            self._skip_request = True
+            self._halt_event.set()
+        return True
+
+    # Returns the first queued item which can be played as tuple 
+    # (MediaItem, timeline), or None if the queue is empty.  Large files
+    # are played with rcmp.smf.SMFStream, see MediaList.playable.
+    def _dequeue(self):
+        while self.play_queue:
+            mi = self.play_queue.popleft()
+            timeline = self.media_list.playable(mi, stream=True)
+            if timeline is not None:
+                return mi, timeline
+            rcmp.log.error(f"Can not play queued file '{mi.filename}'")
+        return None
+
+    # Waits for event_time on the scheduler clock.  Returns lateness or None
+    # if playback is interrupted by stop, exit, seek or skip.  Any other wake
+    # up, i.e. a tempo change, waits again for the new deadline.
+    def _wait(self, event_time):
+        scheduler = self.scheduler
+        halt = self._halt_event
+        while True:
+            lateness = scheduler.wait(event_time, halt)
+            if lateness is not None:
+                return lateness
+            halt.clear()
+            if (self.stop_signal or self.exit_signal or self._skip_request or
+                    self._seek_request is not None):
+                halt.set()
+                return None
+
+    def set_tempo(self, factor):
+        """
+        Scales playback speed, takes effect immediately.
+
+            Parameters:
+                factor (float): 1.0 is the file's own tempo, 0.95 is 5% slower.
+
+            Raises ValueError if factor is not positive.
+        """
+        self.scheduler.set_factor(factor)
+        self._halt_event.set()    # wake the player to recompute its deadline.
+
+    @property
+    def position(self):
+        """Returns playback position in file seconds, or None if stopped."""
+        if self.stop_signal:
+            return None
+        return self.scheduler.position()
+
+    # Plays events against the scheduler clock.
+    # Returns True if all events were played, False if interrupted.
+    def _play_events(self, timeline, events, origin=None, start=0.0):
+        scheduler = self.scheduler
+        scheduler.start(timeline.filename, origin, start)
+        scheduler.stats.preload = self.media_list.preloader.last
+        self._midi_output_port.clear_stats()
+        voices = self.voices
+        send = self._midi_output_port.send_bytes
+        for event_time, data in events:
+            lateness = self._wait(event_time)
+            if lateness is None:
+                return False
+            send(data)
+            voices.update(data)
+            scheduler.stats.add(lateness)
+            self.events_sent += 1
+            if self._play_request_time is not None:
+                # Time from the play request to the first MIDI byte,
+                # less the file's own lead-in.
+                lead_in = (event_time - start) / scheduler.factor
+                wake = scheduler.clock() - self._play_request_time - lead_in
+                scheduler.stats.wake_latency = wake
+                self._play_request_time = None
+            if self.stop_signal or self.exit_signal:
+                return False
+        return True
+
+    # Releases sounding notes only, used between files and on seek.
+    def _release_notes(self):
+        voices = self.voices
+        self.panic.send(self._midi_output_port, voices.sounding(), voices.pedals(), sweep=False)
+        voices.clear()
 
     def _play_mode_loop(self):
-        midi_file = self.media_list.midi_file()
-        note_queue = []
-        if midi_file and self._midi_output_port:
-            for msg in midi_file:
-                time.sleep(msg.time)
-                if not msg.is_meta:
-                    self._midi_output_port.send(msg)
-                    typ = msg.type
-                    if typ == "note_on" and msg.velocity > 0:
-                        note_queue.append((msg.channel, msg.note))
-                    elif typ == "note_off" or (typ=="note_on" and msg.velocity==0):
-                        note_queue.remove((msg.channel, msg.note))
-                if self.stop_signal or self.exit_signal:
-                    break
-                
+        start = self._seek_request or 0.0
+        self._seek_request = None
+        # Either a cached Timeline or, on a cache miss, a TimelineBuilder
+        # which merges the tracks as they are played.  Seeking requires
+        # the complete timeline.
+        timeline = self.media_list.timeline(stream=not start)
+        self.voices.clear()
+        if timeline is None or not self._midi_output_port:
             self.stop_signal = True
-            # Kill all notes in queue
-            for chan, key in note_queue:
-                msg = mido.Message("note_off", channel=chan, note=key)
-                self._midi_output_port.send(msg)
-                time.sleep(0.001)
-            if self._auto_exit:
-                self.exit(0)
-            else:
-                self.midi_reset()
+            return
+        scheduler = self.scheduler
+        halt = self._halt_event
+        events = timeline
+        origin = None
+        if start:
+            events = timeline.events(self._chase(timeline, start))
+        self.precision.begin()
+        while True:
+            played = self._play_events(timeline, events, origin, start)
+            following = None
+            if played:
+                # The next item stays queued during the tail of this file,
+                # so /next and /unqueue still apply to it.
+                if self.play_queue:
+                    self.media_list.request(self.play_queue[0])
+                    self.precision.between()
+                if self._wait(timeline.length) is None:
+                    played = False
+                else:
+                    following = self._dequeue()
+                    # The next file starts exactly where this one ends.
+                    origin = scheduler.deadline(timeline.length)
+            if not played and self._skip_request and not (self.stop_signal or self.exit_signal):
+                halt.clear()
+                following = self._dequeue()
+                origin = None
+            self._skip_request = False
+            if following is None:
+                break
+            self._release_notes()
+            mi, timeline = following
+            self.media_list.select(mi.alias)
+            events = timeline
+            start = 0.0
+            rcmp.log.console(f"Next '{mi.alias}'")
+        self.precision.end()
+
+        if self._seek_request is not None and not (self.stop_signal or self.exit_signal):
+            # Seek during playback, release sounding notes and let
+            # mainloop restart play mode at the new position.
+            self._release_notes()
+            halt.clear()
+            return
+        self.stop_signal = True
+        if self._auto_exit:
+            self.exit(0)    # exit() sends the reset.
+        else:
+            self.midi_reset()
 
     def _stop_mode_loop(self):
+        # Blocks until an OSC callback requests playback or exit.
         while self.stop_signal and not self.exit_signal:
-            pass
+            self._wake_event.wait()
+            self._wake_event.clear()
 
     def mainloop(self):
         while not self.exit_signal:
@@ -137,105 +368,173 @@ class Rcmp:
                 self.media_list.select(lst[0])
 
     def dump(self):
-        print("Rcmp application state:")
-        print(f"\tself._midi_backend      --> {self._midi_backend}")
-        print(f"\tself._midi_output_name  --> {self._midi_output_name}")
-        print(f"\tself._midi_output_port  --> {self._midi_output_port}")
-        print(f"\tself._osc_ip            --> {self._osc_ip}")
-        print(f"\tself._osc_port          --> {self._osc_port}")
-        print(f"\tself._osc_prefix        --> {self._osc_prefix}")
-        print(f"\tself.stop_signal        --> {self.stop_signal}")
-        print(f"\tself.exit_signal        --> {self.exit_signal}")
-        print(f"\tself._auto_exit         --> {self._auto_exit}")
+        rcmp.log.console("Rcmp application state:")
+        rcmp.log.console(f"\tself._midi_backend      --> {self._midi_backend}")
+        rcmp.log.console(f"\tself._midi_output_name  --> {self._midi_output_name}")
+        rcmp.log.console(f"\tself._midi_output_port  --> {self._midi_output_port}")
+        rcmp.log.console(f"\tself._osc_ip            --> {self._osc_ip}")
+        rcmp.log.console(f"\tself._osc_port          --> {self._osc_port}")
+        rcmp.log.console(f"\tself._osc_prefix        --> {self._osc_prefix}")
+        rcmp.log.console(f"\tself.stop_signal        --> {self.stop_signal}")
+        rcmp.log.console(f"\tself.exit_signal        --> {self.exit_signal}")
+        rcmp.log.console(f"\tself._auto_exit         --> {self._auto_exit}")
         self.media_list.dump()
 
     def exit(self, code=0):
-        print("Exit\n", flush=True)
+        rcmp.log.console("Exit\n")
         self.midi_reset()
+        if self._midi_output_port:
+            self._midi_output_port.close()
+        self.layers.close()
         self._osc_handler.close()
+        if self._osc_thread and self._osc_thread is not current_thread():
+            self._osc_thread.join(1.0)
+        self.media_list.unwatch()
+        if self.media_list.index:
+            self.media_list.index.close()
+        rcmp.log.LOGGER.close()
         raise SystemExit()
         
+    @classmethod
+    def _configure_log(cls, args):
+        rcmp.log.LOGGER.level = rcmp.log.LEVELS[args["log_level"]]
+        if args["log_file"]:
+            try:
+                rcmp.log.LOGGER.open_file(args["log_file"])
+            except OSError as err:
+                rcmp.log.warning(f"Can not open log file '{args['log_file']}': {err}")
+
+    @classmethod
+    def _configure_media_index(cls, app, args):
+        if args["no_index"]:
+            return
+        try:
+            app.media_list.index = rcmp.index.MediaIndex(args["index"])
+        except (OSError, sqlite3.Error) as err:
+            rcmp.log.warning(f"Can not open media index: {err}")
+
     @classmethod
     def _configure_midi_backend(cls, app, args):
         app._midi_backend = args["backend"]
         mido.set_backend(app._midi_backend)
 
     @classmethod
-    def _use_default_midi_output(cls, app, outputs):
-        if outputs:
-            name = outputs[0]
-            port = mido.open_output(name)
-            app._midi_output_name = name
-            app._midi_output_port = port
-        else:
-            print("ERROR Can not set MIDI output")
-            sys.exit(1)
-            
-    @classmethod
-    def _configure_midi_output(cls, app, args):
-        outputs = mido.get_output_names()
-        out = args["out"]
-        name = port = None
+    def _open_midi_output(cls, out, outputs):
+        # Opens output by list position or name.
+        # Returns tuple (name, port) or None.
         try:
             n = int(out)
             if 0 <= n < len(outputs):
-                name = outputs[n]
-                app._midi_output_name = name
-                app._midi_output_port = mido.open_output(name)
-            else:
-                print(f"WARNING: Invalid MIDI output number: {n}, using default 0.")
-                cls._use_default_midi_output(app, outputs)
-                port = mido.open_output(name)
+                return outputs[n], mido.open_output(outputs[n])
+            rcmp.log.warning(f"Invalid MIDI output number: {n}")
         except ValueError:  # Select port by name
             try:
-                name = out
-                port = mido.open_output(name)
-                app._midi_output_name = name
-                app._midi_output_port = port
+                return out, mido.open_output(out)
             except OSError:
-                print(f"WARNING: Invalid MIDI output name: '{out}', using default.")
-                cls._use_default_midi_output(app, outputs)
-        print(f"MIDI BACKEND: '{app._midi_backend}'  OUTPUT: '{app._midi_output_name}'")
+                rcmp.log.warning(f"Invalid MIDI output name: '{out}'")
+        return None
+
+    @classmethod
+    def _configure_midi_output(cls, app, args):
+        outputs = mido.get_output_names()
+        fanout = rcmp.fanout.FanOut()
+        for out in args["out"] or ["0"]:
+            opened = cls._open_midi_output(out, outputs)
+            if opened and opened[0] not in fanout.names:
+                fanout.add(*opened)
+        if not fanout:
+            if outputs:
+                rcmp.log.warning("Using default MIDI output 0.")
+                fanout.add(outputs[0], mido.open_output(outputs[0]))
+            else:
+                rcmp.log.error("Can not set MIDI output.")
+                rcmp.log.flush()
+                sys.exit(1)
+        app._midi_output_name = ", ".join(fanout.names)
+        app._midi_output_port = fanout
+        rcmp.log.console(f"MIDI BACKEND: '{app._midi_backend}'  OUTPUT: '{app._midi_output_name}'")
+
+    @classmethod
+    def _configure_layers(cls, app, args):
+        outputs = mido.get_output_names()
+        for out in args["layer"] or []:
+            opened = cls._open_midi_output(out, outputs)
+            if opened:
+                # Threaded, so a slow output delays only its own layer.
+                port = rcmp.fanout.FanOut(threaded=True)
+                port.add(*opened)
+                layer = app.layers.add(opened[0], port)
+                rcmp.log.console(f"LAYER {layer.number}  OUTPUT: '{layer.name}'")
                 
     @classmethod
     def _configure_osc(cls, app, args):
         app._osc_port = int(args["port"])
         app._osc_ip = args["ip"]
         app._osc_prefix = args["osc"]
+        import rcmp.oschandler   # deferred, imports asyncio and pyOSC3.
         app._osc_handler = rcmp.oschandler.OSCHandler(app)
              
     @classmethod
     def list_midi_outputs(cls, app):
-        print(f"MIDI backend: '{app._midi_backend}'")
-        print(f"Available MIDI Outputs:")
+        rcmp.log.console(f"MIDI backend: '{app._midi_backend}'")
+        rcmp.log.console(f"Available MIDI Outputs:")
         for i, name in enumerate(mido.get_output_names()):
-            print(f"\t[{i}]  '{name}'")
+            rcmp.log.console(f"\t[{i}]  '{name}'")
+        rcmp.log.flush()
         sys.exit(0)
         
     @classmethod
-    def run(cls, argv):
+    def start(cls, args, file_argument, is_file, profile):
+        """
+        Configures and runs the player, called by rcmp.startup.main().
+
+        Informational options are handled before the media directory is
+        scanned or the index opened.
+
+            Parameters:
+                args (dict): Parsed command line options.
+                file_argument (str): MIDI file or directory, may be None.
+                is_file (bool): True if file_argument is a file.
+                profile (rcmp.startup.StartupProfile): Records the time 
+                    taken by each step.
+        """
+        cls._configure_log(args)
         app = Rcmp()
-        parser = rcmp.options.create_argparse()
-        file_argument, is_file, argv = rcmp.options.extract_file_argument(argv)
-        args = vars(parser.parse_args(argv))
-        app._configure_media_list(file_argument, is_file)
-        
-        if args["docs"]:
-            print(rcmp.docs.DOCS)
-            sys.exit(0)
-        
-        app._auto_exit = args["exit"]
         cls._configure_midi_backend(app, args)
-
         if args["list"]:
             cls.list_midi_outputs(app)
+        profile.mark("backend")
+
+        cls._configure_media_index(app, args)
+        profile.mark("index")
+        app.media_list.recursive = args["recursive"]
+        app.media_list.jobs = args["jobs"]
+        app._configure_media_list(file_argument, is_file)
+        profile.mark("media scan")
+        
+        app._auto_exit = args["exit"]
+        app.panic = rcmp.panic.Panic(args["reset"], args["reset_rate"])
+        app.layers.panic = app.panic
+        app.precision = rcmp.precision.Precision(args["precision"], args["spin"] / 1000.0,
+                                                 args["realtime"])
+        app.precision.configure(app.scheduler)
+        app.media_list.cache.max_bytes = args["cache_size"] * 1024 * 1024
+        app.media_list.stream_size = args["stream_size"] * 1024 * 1024 or None
+        if args["preload_next"]:
+            app.media_list.preload_ahead = 1
+        app.media_list.preload()
         
         cls._configure_midi_output(app, args)
+        cls._configure_layers(app, args)
+        profile.mark("midi outputs")
         cls._configure_osc(app, args)
+        profile.mark("osc")
         
         if args["play"] and app.media_list.current_item:
             app.stop_signal = False
-        app._start_osc_poll_loop()
+        app._start_osc_server()
+        if args["watch"]:
+            app.media_list.watch(app.osc_server.call_soon)
+        profile.report()
         app.print_prompt()
         app.mainloop()
-        
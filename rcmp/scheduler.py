@@ -0,0 +1,284 @@
+# rcmp.scheduler
+#
+# Defines Scheduler and LatenessStats classes.
+#
+# Events are played against absolute deadlines measured from the start
+# of playback.  Sleeping for each relative delta time lets oversleep and
+# send() overhead accumulate; waiting for origin + event_time does not.
+#
+# Optionally the final part of each wait is spent busy-waiting on the clock
+# instead of sleeping, see rcmp.precision.
+#
+
+from array import array
+from bisect import bisect_left
+import math
+import time
+
+
+# Upper bounds, in seconds, of the lateness histogram buckets.  The final
+# bucket holds everything later than the last bound.
+HISTOGRAM_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05)
+
+# Events later than this, in seconds, are counted as late.
+LATE_THRESHOLD = 0.001
+
+
+class LatenessStats:
+
+    """Accumulates per-event lateness for a single playback run."""
+
+    def __init__(self, filename=None):
+        """
+        Constructs new instance of LatenessStats.
+
+            Parameters:
+                filename (str): Optional name of the file being played.
+        """
+        self.filename = filename
+        self._samples = array('d')
+        self._total = 0.0
+        self._squares = 0.0
+        self._max = 0.0
+        self.histogram = array('I', [0] * (len(HISTOGRAM_BOUNDS) + 1))
+        self.late = 0
+        self.wake_latency = None
+        self.preload = None
+        self.spin = 0.0
+
+    def clear(self, filename=None):
+        self.filename = filename
+        self._samples = array('d')
+        self._total = 0.0
+        self._squares = 0.0
+        self._max = 0.0
+        self.histogram = array('I', [0] * (len(HISTOGRAM_BOUNDS) + 1))
+        self.late = 0
+        self.wake_latency = None
+        self.preload = None
+        self.spin = 0.0
+
+    def add(self, lateness):
+        """
+        Records lateness of a single event.
+
+            Parameters:
+                lateness (float): Seconds between the event deadline and the
+                actual dispatch time.  Negative values are recorded as 0.
+        """
+        if lateness < 0.0:
+            lateness = 0.0
+        self._samples.append(lateness)
+        self._total += lateness
+        self._squares += lateness * lateness
+        if lateness > self._max:
+            self._max = lateness
+        self.histogram[bisect_left(HISTOGRAM_BOUNDS, lateness)] += 1
+        if lateness > LATE_THRESHOLD:
+            self.late += 1
+
+    @property
+    def count(self):
+        return len(self._samples)
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        n = len(self._samples)
+        if n:
+            return self._total / n
+        return 0.0
+
+    @property
+    def jitter(self):
+        """Returns standard deviation of lateness."""
+        n = len(self._samples)
+        if not n:
+            return 0.0
+        mean = self._total / n
+        return math.sqrt(max(0.0, self._squares / n - mean * mean))
+
+    @property
+    def final(self):
+        """Returns lateness of the most recent event, the end-of-run drift."""
+        if self._samples:
+            return self._samples[-1]
+        return 0.0
+
+    def percentile(self, p):
+        """
+        Returns the p-th percentile of recorded lateness.
+
+            Parameters:
+                p (float): Percentile in range 0..100.
+
+            Returns:
+                float, seconds.
+        """
+        n = len(self._samples)
+        if not n:
+            return 0.0
+        ordered = sorted(self._samples)
+        k = min(n - 1, max(0, int(round(p / 100.0 * (n - 1)))))
+        return ordered[k]
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def summary(self):
+        """
+        Returns dictionary of lateness statistics in seconds.
+        """
+        return {"file": self.filename,
+                "events": self.count,
+                "max": self.max,
+                "p99": self.p99,
+                "mean": self.mean,
+                "jitter": self.jitter,
+                "final": self.final,
+                "late": self.late,
+                "wake": self.wake_latency,
+                "preload": self.preload,
+                "spin": self.spin}
+
+    def __str__(self):
+        acc = f"Timing: {self.filename}\n"
+        acc += f"    events {self.count}\n"
+        acc += f"    max    {self.max * 1000:8.3f} ms\n"
+        acc += f"    p99    {self.p99 * 1000:8.3f} ms\n"
+        acc += f"    mean   {self.mean * 1000:8.3f} ms\n"
+        acc += f"    jitter {self.jitter * 1000:8.3f} ms\n"
+        acc += f"    final  {self.final * 1000:8.3f} ms\n"
+        acc += f"    late   {self.late:8d}   (> {LATE_THRESHOLD * 1000:g} ms)"
+        if self.wake_latency is not None:
+            acc += f"\n    wake   {self.wake_latency * 1000:8.3f} ms"
+        if self.preload:
+            acc += f"\n    preload {self.preload}"
+        if self.spin:
+            acc += f"\n    spin   {self.spin * 1000:8.3f} ms   (precision mode)"
+        return acc
+
+
+class Scheduler:
+
+    """
+    Waits for events against an absolute monotonic clock.
+
+    Event times are given in seconds from the start of the file.  The
+    clock value of an event time is
+
+        anchor_clock + (event_time - anchor_position) / factor
+
+    where factor is the tempo scale.  Changing the factor re-anchors at the
+    current position, so the position is continuous across the change and
+    no event times need to be recomputed.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        """
+        Constructs new instance of Scheduler.
+
+            Parameters:
+                clock (function): Monotonic clock returning seconds,
+                defaults to time.perf_counter.
+        """
+        self.clock = clock
+        self._anchor_clock = clock()
+        self._anchor_position = 0.0
+        self._factor = 1.0
+        self.spin = 0.0    # seconds busy-waited before each deadline, 0 -> sleep only.
+        self.stats = LatenessStats()
+
+    @property
+    def origin(self):
+        """Returns clock value of event time 0."""
+        return self._anchor_clock - self._anchor_position / self._factor
+
+    @property
+    def factor(self):
+        return self._factor
+
+    def set_factor(self, factor):
+        """
+        Changes tempo scale, takes effect from the current position.
+
+            Parameters:
+                factor (float): Playback speed, 1.0 is the file's own tempo,
+                    1.1 is 10% faster.
+
+            Raises ValueError if factor is not positive.
+        """
+        factor = float(factor)
+        if not factor > 0:
+            raise ValueError(f"Invalid tempo factor: {factor}")
+        now = self.clock()
+        self._anchor_position = self.position(now)
+        self._anchor_clock = now
+        self._factor = factor
+
+    def position(self, now=None):
+        """Returns the current position in file seconds."""
+        if now is None:
+            now = self.clock()
+        return self._anchor_position + (now - self._anchor_clock) * self._factor
+
+    def start(self, filename=None, origin=None, position=0.0):
+        """
+        Marks the start of a playback run and clears the statistics.
+
+        The tempo factor is retained.
+
+            Parameters:
+                filename (str): Optional name of the file being played.
+                origin (float): Optional clock value at which the file is at
+                    position, defaults to now.
+                position (float): File time, in seconds, at origin.
+        """
+        if origin is None:
+            origin = self.clock()
+        self._anchor_clock = origin
+        self._anchor_position = position
+        self.stats.clear(filename)
+        self.stats.spin = self.spin
+
+    def deadline(self, event_time):
+        """Returns absolute clock value for event_time."""
+        return self._anchor_clock + (event_time - self._anchor_position) / self._factor
+
+    def wait(self, event_time, halt=None):
+        """
+        Blocks until the deadline for event_time.
+
+        If spin is set, sleeps until spin seconds before the deadline and
+        then polls the clock, which avoids the wake up latency of sleep at
+        the cost of CPU time.
+
+            Parameters:
+                event_time (float): Seconds since start of the file.
+                halt (threading.Event): Optional event which aborts the wait
+                    as soon as it is set.
+
+            Returns:
+                Lateness in seconds, the difference between the actual wake
+                time and the deadline, or None if the wait was aborted by halt.
+        """
+        deadline = self.deadline(event_time)
+        clock = self.clock
+        delay = deadline - self.spin - clock()
+        if delay > 0:
+            if halt is None:
+                time.sleep(delay)
+            elif halt.wait(delay):
+                return None
+        if self.spin:
+            now = clock()
+            while now < deadline:
+                if halt is not None and halt.is_set():
+                    return None
+                now = clock()
+            return now - deadline
+        return clock() - deadline
@@ -0,0 +1,230 @@
+# rcmp.smf
+#
+# Defines SMFReader and SMFStream classes.
+#
+# A Standard MIDI File reader which memory-maps the file and decodes events
+# only as playback reaches them.  No mido Message objects are built, each
+# event is produced as the raw message bytes, so memory use does not depend
+# on the size of the file.  This is used to play files which are too large
+# to be worth compiling into a Timeline.
+#
+# Decoding follows mido.MidiFile: meta events do not set running status,
+# sysex is produced as F0 data F7, and tracks are merged in time order with
+# simultaneous events in track order.
+#
+
+import heapq
+import mmap
+import struct
+import mido
+import rcmp.merge
+
+
+# Length of channel and system common messages by status byte, 0 if the
+# status byte can not appear in a track.
+_LENGTHS = bytearray(256)
+for _status in range(0x80, 0xF0):
+    _LENGTHS[_status] = 2 if 0xC0 <= _status < 0xE0 else 3
+_LENGTHS[0xF1] = 2
+_LENGTHS[0xF2] = 3
+_LENGTHS[0xF3] = 2
+for _status in (0xF6, 0xF8, 0xFA, 0xFB, 0xFC, 0xFE):
+    _LENGTHS[_status] = 1
+
+_META = 0xFF
+_SET_TEMPO = 0x51
+
+
+class SMFReader:
+
+    """Memory-mapped Standard MIDI File."""
+
+    def __init__(self, filename):
+        """
+        Opens and maps filename, and locates its track chunks.
+
+            Parameters:
+                filename (str)
+
+            Raises OSError, EOFError or ValueError if filename is not a
+            readable MIDI file, and TypeError for type 2 files.
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+        except (EOFError, ValueError, TypeError):
+            self.close()
+            raise
+
+    def _read_header(self):
+        mm = self._map
+        if len(mm) < 14 or mm[0:4] != b"MThd":
+            raise ValueError(f"'{self.filename}' is not a MIDI file")
+        size, self.midi_type, count, self.ticks_per_beat = struct.unpack(">IHHH", mm[4:14])
+        if self.midi_type == 2:
+            raise TypeError("can't merge tracks in type 2 (asynchronous) file")
+        if self.ticks_per_beat & 0x8000:
+            raise ValueError("SMPTE time division is not supported")
+        self.tracks = []     # (start, end) offset of each track's events.
+        pos = 8 + size
+        while pos + 8 <= len(mm) and len(self.tracks) < count:
+            name = mm[pos:pos+4]
+            length = struct.unpack(">I", mm[pos+4:pos+8])[0]
+            start = pos + 8
+            if name == b"MTrk":
+                self.tracks.append((start, min(start + length, len(mm))))
+            pos = start + length
+        if len(self.tracks) < count:
+            raise EOFError(f"'{self.filename}' has {len(self.tracks)} of {count} tracks")
+
+    @property
+    def track_count(self):
+        return len(self.tracks)
+
+    def track_events(self, n):
+        """
+        Decodes track n.
+
+            Yields:
+                tuple (delta_ticks, data, tempo) for every event.  data is
+                the raw message bytes, or None for meta events.  tempo is
+                set only for set_tempo meta events.
+
+            Raises ValueError or EOFError if the track is malformed.
+        """
+        mm = self._map
+        pos, end = self.tracks[n]
+        running = None
+        try:
+            while pos < end:
+                delta = 0
+                while True:
+                    b = mm[pos]
+                    pos += 1
+                    delta = (delta << 7) | (b & 0x7F)
+                    if b < 0x80:
+                        break
+                status = mm[pos]
+                if status < 0x80:
+                    if running is None:
+                        raise ValueError("running status without last status")
+                    status, first, head = running, pos, bytes((running,))
+                else:
+                    first, head = pos + 1, None
+                    if status != _META:
+                        running = status
+                if status == _META:
+                    meta_type = mm[first]
+                    length, pos = self._vlq(first + 1)
+                    tempo = None
+                    if meta_type == _SET_TEMPO and length == 3:
+                        tempo = int.from_bytes(mm[pos:pos+3], "big")
+                    pos += length
+                    yield delta, None, tempo
+                elif status == 0xF0 or status == 0xF7:
+                    length, pos = self._vlq(first)
+                    payload = mm[pos:pos+length]
+                    pos += length
+                    if payload[:1] == b"\xF0":
+                        payload = payload[1:]
+                    if payload[-1:] == b"\xF7":
+                        payload = payload[:-1]
+                    yield delta, b"\xF0" + payload + b"\xF7", None
+                else:
+                    length = _LENGTHS[status]
+                    if not length:
+                        raise ValueError(f"undefined status byte 0x{status:02x}")
+                    pos = first + length - 1
+                    if pos > end:
+                        raise EOFError("track ends inside a message")
+                    if head is None:
+                        yield delta, mm[first-1:pos], None
+                    else:
+                        yield delta, head + mm[first:pos], None
+        except IndexError:
+            raise EOFError("track ends inside an event") from None
+
+    def _vlq(self, pos):
+        # Returns tuple (value, position after value).
+        mm = self._map
+        value = 0
+        while True:
+            b = mm[pos]
+            pos += 1
+            value = (value << 7) | (b & 0x7F)
+            if b < 0x80:
+                return value, pos
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SMFStream:
+
+    """
+    Plays a MIDI file directly from an SMFReader.
+
+    Iterating an SMFStream yields (seconds, bytes) for each playable event,
+    the same protocol as iterating a rcmp.timeline.Timeline.  length is set
+    once iteration completes.  The file is closed when iteration ends or is
+    abandoned.
+    """
+
+    def __init__(self, filename):
+        """
+        Constructs new instance of SMFStream.
+
+        Raises one of rcmp.timeline.LOAD_ERRORS if filename is not a
+        readable type 0 or type 1 MIDI file.
+        """
+        self.reader = SMFReader(filename)
+        self.filename = filename
+        self.ticks_per_beat = self.reader.ticks_per_beat
+        self.midi_type = self.reader.midi_type
+        self.track_count = self.reader.track_count
+        self.length = 0.0
+
+    def __iter__(self):
+        reader = self.reader
+        tpb = self.ticks_per_beat
+        tempo = rcmp.merge.DEFAULT_TEMPO
+        heap = []
+        for index in range(reader.track_count):
+            it = reader.track_events(index)
+            for delta, data, value in it:
+                heap.append((delta, index, data, value, it))
+                break
+        heapq.heapify(heap)
+        last_tick = 0
+        seconds = 0.0
+        try:
+            while heap:
+                tick, index, data, value, it = heap[0]
+                if tick != last_tick:
+                    seconds += mido.tick2second(tick - last_tick, tpb, tempo)
+                    last_tick = tick
+                if data is not None:
+                    yield seconds, data
+                elif value is not None:
+                    tempo = value
+                for delta, data, value in it:
+                    heapq.heapreplace(heap, (tick + delta, index, data, value, it))
+                    break
+                else:
+                    heapq.heappop(heap)
+            self.length = seconds
+        finally:
+            reader.close()
+
+    def __str__(self):
+        return f"SMFStream '{self.filename}'  length: {self.length:.3f}"
@@ -0,0 +1,76 @@
+# rcmp.startup
+#
+# Application entry point and StartupProfile class.
+#
+# Informational options (--docs) are handled here before rcmp.rcmp is
+# imported, so they do not pay for importing mido, asyncio or pyOSC3, and
+# never scan the media directory.  The remaining modules are imported only
+# when the player is actually started.
+#
+
+import time
+import rcmp.docs
+import rcmp.log
+import rcmp.options
+
+
+class StartupProfile:
+
+    """Records elapsed time of each startup step."""
+
+    def __init__(self, enabled=False, clock=time.perf_counter):
+        self.enabled = enabled
+        self.clock = clock
+        self.start = clock()
+        self._last = self.start
+        self.steps = []      # of (name, seconds)
+
+    def mark(self, name):
+        """Records time since the previous mark under name."""
+        now = self.clock()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.start
+
+    def report(self):
+        """
+        Prints steps if enabled, through rcmp.log so they follow the
+        startup messages already queued.
+        """
+        if self.enabled:
+            rcmp.log.console(self)
+
+    def __str__(self):
+        acc = "Startup profile:"
+        for name, seconds in self.steps:
+            acc += f"\n    {name:16} {seconds * 1000:9.3f} ms"
+        acc += f"\n    {'total':16} {self.total * 1000:9.3f} ms"
+        return acc
+
+
+def main(argv):
+    """
+    Starts rcmp.
+
+        Parameters:
+            argv (list): Command line, argv[0] is the program name.
+
+        Returns:
+            Exit code.
+    """
+    profile = StartupProfile()
+    parser = rcmp.options.create_argparse()
+    file_argument, is_file, argv = rcmp.options.extract_file_argument(argv)
+    args = vars(parser.parse_args(argv))
+    profile.enabled = args["startup_profile"]
+    profile.mark("arguments")
+    if args["docs"]:
+        print(rcmp.docs.DOCS)
+        return 0
+    from rcmp.rcmp import Rcmp
+    profile.mark("imports")
+    Rcmp.start(args, file_argument, is_file, profile)
+    return 0
@@ -0,0 +1,97 @@
+# rcmp.telemetry
+#
+# Defines Telemetry class.
+#
+# Collects live metrics for the /rcmp/stats OSC command and returns them
+# as an OSC bundle, one message per metric, which is sent back to the
+# client instead of printed.  Only counters which are already maintained by
+# the playback and OSC paths are read, nothing is sorted or copied, so a
+# monitoring client polling /rcmp/stats does not disturb playback timing.
+#
+#   <prefix>/stats/state      s   'playing' or 'stopped'
+#   <prefix>/stats/file       s   file being played, '' if none
+#   <prefix>/stats/position   f   seconds, -1 if stopped
+#   <prefix>/stats/events     i   events sent in the current run
+#   <prefix>/stats/rate       f   events per second since the previous request
+#   <prefix>/stats/late       i   events later than LATE_THRESHOLD
+#   <prefix>/stats/lateness   fff max, mean and approximate p99 in ms
+#   <prefix>/stats/jitter     f   standard deviation of lateness in ms
+#   <prefix>/stats/histogram  i.. event count per lateness bucket
+#   <prefix>/stats/bounds     f.. upper bound of each bucket in ms
+#   <prefix>/stats/cache      fii hit rate, hits, misses
+#   <prefix>/stats/cpu        f   process CPU use since the previous request, 0..1
+#   <prefix>/stats/osc        ii  datagrams received, messages dispatched
+#
+
+import time
+import rcmp.scheduler
+
+
+class Telemetry:
+
+    """Live metrics of an Rcmp instance."""
+
+    def __init__(self, app, clock=time.perf_counter):
+        self.app = app
+        self.clock = clock
+        self._previous = (clock(), time.process_time(), 0)
+
+    @staticmethod
+    def approximate_percentile(stats, p):
+        """
+        Returns upper bound of the histogram bucket holding the p-th
+        percentile of stats, or stats.max for the overflow bucket.
+        """
+        target = stats.count * p / 100.0
+        bounds = rcmp.scheduler.HISTOGRAM_BOUNDS
+        acc = 0
+        for i, n in enumerate(stats.histogram):
+            acc += n
+            if acc >= target and i < len(bounds):
+                return min(bounds[i], stats.max)
+        return stats.max
+
+    def sample(self):
+        """
+        Returns dictionary of current metrics.
+
+        Rate and CPU use are measured since the previous call.
+        """
+        app = self.app
+        stats = app.timing_stats
+        now, cpu = self.clock(), time.process_time()
+        then, then_cpu, then_sent = self._previous
+        sent = app.events_sent
+        elapsed = now - then
+        self._previous = (now, cpu, sent)
+        position = app.position
+        cache = app.media_list.cache
+        server = app.osc_server
+        return {"state": "stopped" if app.stop_signal else "playing",
+                "file": stats.filename or "",
+                "position": -1.0 if position is None else position,
+                "events": stats.count,
+                "rate": (sent - then_sent) / elapsed if elapsed > 0 else 0.0,
+                "late": stats.late,
+                "lateness": (stats.max * 1000, stats.mean * 1000,
+                             self.approximate_percentile(stats, 99) * 1000),
+                "jitter": stats.jitter * 1000,
+                "histogram": tuple(stats.histogram),
+                "bounds": tuple(b * 1000 for b in rcmp.scheduler.HISTOGRAM_BOUNDS),
+                "cache": (cache.hit_rate, cache.hits, cache.misses),
+                "cpu": (cpu - then_cpu) / elapsed if elapsed > 0 else 0.0,
+                "osc": (server.received, server.dispatched) if server else (0, 0)}
+
+    def bundle(self, prefix):
+        """Returns current metrics as pyOSC3.OSCBundle."""
+        import pyOSC3    # deferred, only needed once an OSC server is running.
+        bundle = pyOSC3.OSCBundle()
+        for key, value in self.sample().items():
+            msg = pyOSC3.OSCMessage(f"{prefix}/stats/{key}")
+            if isinstance(value, tuple):
+                for v in value:
+                    msg.append(v)
+            else:
+                msg.append(value)
+            bundle.append(msg)
+        return bundle
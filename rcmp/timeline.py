@@ -0,0 +1,356 @@
+# rcmp.timeline
+#
+# Defines Timeline and TimelineCache classes.
+#
+# A Timeline is a MIDI file compiled once into flat arrays of absolute
+# event times and raw message bytes.  Meta events are consumed at compile
+# time (tempo changes are folded into the event times) and are not stored.
+# Tracks are merged with the streaming engine in rcmp.merge.
+#
+
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+import os
+import threading
+import mido
+import rcmp.merge
+import rcmp.chase
+
+
+# Exceptions raised by mido for missing, unreadable or malformed MIDI files.
+# Malformed meta events raise IndexError or KeyError from mido's decoders.
+LOAD_ERRORS = (OSError, EOFError, ValueError, TypeError, IndexError, KeyError)
+
+
+class Timeline:
+
+    """Compact, array-backed list of playable events for a single MIDI file."""
+
+    def __init__(self, filename):
+        """
+        Constructs new, empty, instance of Timeline.
+
+            Parameters:
+                filename (str): The source MIDI filename.
+        """
+        self.filename = filename
+        self.ticks = array('Q')       # absolute time in ticks
+        self.times = array('d')       # absolute time in seconds
+        self.offsets = array('I', [0])  # event i is data[offsets[i]:offsets[i+1]]
+        self.data = bytearray()
+        self.tempo_ticks = array('Q')   # tempo map, tick of each tempo change
+        self.tempo_values = array('I')  # tempo map, microseconds per beat
+        self.length = 0.0             # seconds, including trailing meta events
+        self.ticks_per_beat = 0
+        self.midi_type = 0
+        self.track_count = 0
+        self._chase_index = None
+
+    @classmethod
+    def compile(cls, midi_file):
+        """
+        Compiles a Timeline from a mido.MidiFile.
+
+            Parameters:
+                midi_file (mido.MidiFile)
+
+            Returns:
+                Timeline
+        """
+        builder = TimelineBuilder(midi_file)
+        for _ in builder:
+            pass
+        return builder.timeline
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Parses and compiles MIDI file.
+
+        Raises one of LOAD_ERRORS if filename is not a readable MIDI file.
+        """
+        return cls.compile(mido.MidiFile(filename))
+
+    def append(self, tick, seconds, data):
+        self.ticks.append(tick)
+        self.times.append(seconds)
+        self.data.extend(data)
+        self.offsets.append(len(self.data))
+
+    def event(self, index):
+        """
+        Returns tuple (seconds, bytes) for event at index.
+        """
+        offsets = self.offsets
+        return self.times[index], bytes(self.data[offsets[index]:offsets[index+1]])
+
+    @property
+    def nbytes(self):
+        """Returns approximate memory footprint in bytes."""
+        return (self.ticks.itemsize * len(self.ticks) +
+                self.times.itemsize * len(self.times) +
+                self.offsets.itemsize * len(self.offsets) +
+                len(self.data) +
+                self.tempo_ticks.itemsize * len(self.tempo_ticks) +
+                self.tempo_values.itemsize * len(self.tempo_values))
+
+    def tempo_at(self, tick):
+        """Returns tempo, in microseconds per beat, in effect at tick."""
+        n = bisect_right(self.tempo_ticks, tick) - 1
+        if n < 0:
+            return rcmp.merge.DEFAULT_TEMPO
+        return self.tempo_values[n]
+
+    @property
+    def chase_index(self):
+        """
+        Returns rcmp.chase.ChaseIndex for this timeline.
+
+        The index is built on first use.  It is not included in nbytes.
+        """
+        if self._chase_index is None:
+            self._chase_index = rcmp.chase.ChaseIndex(self)
+        return self._chase_index
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        """Yields (seconds, bytes) for each event in time order."""
+        return self.events()
+
+    def events(self, start=0):
+        """
+        Yields (seconds, bytes) for each event in time order.
+
+            Parameters:
+                start (int): Index of first event.
+        """
+        times = self.times
+        offsets = self.offsets
+        data = self.data
+        for i in range(start, len(times)):
+            yield times[i], bytes(data[offsets[i]:offsets[i+1]])
+
+    def __str__(self):
+        return f"Timeline '{self.filename}'  events: {len(self)}  length: {self.length:.3f}"
+
+
+class TimelineBuilder:
+
+    """
+    Compiles a Timeline while its events are being played.
+
+    Iterating a TimelineBuilder yields (seconds, bytes) for each playable
+    event as soon as it is merged from the file's tracks, the same protocol
+    as iterating a Timeline, while appending the event to self.timeline.
+    When iteration completes, the timeline is optionally stored in a
+    TimelineCache.
+
+    If iteration is abandoned, i.e. playback is stopped, on_abandon is
+    called with the builder.  Iterating again, or calling finish(), 
+    continues merging where the abandoned iteration stopped.
+    """
+
+    def __init__(self, midi_file, cache=None, stamp=None):
+        """
+        Constructs new instance of TimelineBuilder.
+
+            Parameters:
+                midi_file (mido.MidiFile): A type 0 or type 1 MIDI file.
+                cache (TimelineCache): Optional, receives the complete timeline.
+                stamp (tuple): (mtime_ns, size) of the file, required with cache.
+
+            Raises TypeError for type 2 (asynchronous) files.
+        """
+        if midi_file.type == 2:
+            raise TypeError("can't merge tracks in type 2 (asynchronous) file")
+        self.midi_file = midi_file
+        self.cache = cache
+        self.stamp = stamp
+        self.filename = midi_file.filename
+        tl = self.timeline = Timeline(midi_file.filename)
+        tl.ticks_per_beat = midi_file.ticks_per_beat
+        tl.midi_type = midi_file.type
+        tl.track_count = len(midi_file.tracks)
+        self.length = 0.0
+        self.on_abandon = None    # function(builder)
+        self._merged = None       # merge_events iterator, shared by all iterations.
+        self._seconds = 0.0
+
+    def __iter__(self):
+        tl = self.timeline
+        if self._merged is None:
+            self._merged = rcmp.merge.merge_events(self.midi_file.tracks, tl.ticks_per_beat)
+        try:
+            for tick, self._seconds, msg in self._merged:
+                if msg.is_meta:
+                    if msg.type == "set_tempo":
+                        tl.tempo_ticks.append(tick)
+                        tl.tempo_values.append(msg.tempo)
+                    continue
+                data = msg.bytes()
+                tl.append(tick, self._seconds, data)
+                yield self._seconds, data
+        except GeneratorExit:
+            if self.on_abandon is not None:
+                self.on_abandon(self)
+            raise
+        tl.length = self.length = self._seconds
+        if self.cache is not None:
+            self.cache.put(self.filename, self.stamp, tl)
+
+    def finish(self):
+        """Compiles the remaining events, returns the complete Timeline."""
+        self.on_abandon = None
+        for _ in self:
+            pass
+        return self.timeline
+
+
+class TimelineCache:
+
+    """
+    Memory-bounded LRU cache of compiled Timelines.
+
+    Entries are keyed by filename and are recompiled whenever the file's
+    modification time or size changes.
+    """
+
+    def __init__(self, max_bytes=64*1024*1024):
+        """
+        Constructs new instance of TimelineCache.
+
+            Parameters:
+                max_bytes (int): Upper bound on the combined size of all cached
+                    timelines.  The least recently used entries are evicted first.
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # filename -> (stamp, Timeline)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stamp(filename):
+        """
+        Returns (mtime_ns, size) for filename.
+
+        Raises OSError if the file can not be read.
+        """
+        st = os.stat(filename)
+        return st.st_mtime_ns, st.st_size
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def lookup(self, filename):
+        """
+        Returns cached Timeline for filename without compiling.
+
+        Returns None if filename is not cached, or the cached entry is stale.
+        Does not update the hit/miss counters.
+        """
+        try:
+            stamp = self.stamp(filename)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry and entry[0] == stamp:
+                return entry[1]
+        return None
+
+    def get(self, filename):
+        """
+        Returns Timeline for filename, compiling it if required.
+
+            Parameters:
+                filename (str)
+
+            Returns:
+                Timeline or None if filename is not a readable MIDI file.
+        """
+        try:
+            stamp = self.stamp(filename)
+        except OSError:
+            self.invalidate(filename)
+            return None
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(filename)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        try:
+            timeline = Timeline.load(filename)
+        except LOAD_ERRORS:
+            self.invalidate(filename)
+            return None
+        self.put(filename, stamp, timeline)
+        return timeline
+
+    def stream(self, filename):
+        """
+        Returns TimelineBuilder for filename.
+
+        The builder's events may be played while the file is being compiled,
+        once it has been fully iterated the timeline is added to the cache.
+        Counts as a cache miss.
+
+            Returns:
+                TimelineBuilder or None if filename is not a readable MIDI file.
+        """
+        try:
+            stamp = self.stamp(filename)
+            builder = TimelineBuilder(mido.MidiFile(filename), self, stamp)
+        except LOAD_ERRORS:
+            self.invalidate(filename)
+            return None
+        self.misses += 1
+        return builder
+
+    def put(self, filename, stamp, timeline):
+        with self._lock:
+            old = self._entries.pop(filename, None)
+            if old:
+                self._size -= old[1].nbytes
+            self._entries[filename] = (stamp, timeline)
+            self._size += timeline.nbytes
+            # The most recent entry is kept even if it alone exceeds max_bytes.
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted.nbytes
+
+    def invalidate(self, filename):
+        """Removes filename from the cache."""
+        with self._lock:
+            old = self._entries.pop(filename, None)
+            if old:
+                self._size -= old[1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = 0
+
+    @property
+    def hit_rate(self):
+        n = self.hits + self.misses
+        if n:
+            return self.hits / n
+        return 0.0
+
+    def __str__(self):
+        return (f"TimelineCache  entries: {len(self)}  bytes: {self._size}/{self.max_bytes}"
+                f"  hits: {self.hits}  misses: {self.misses}")
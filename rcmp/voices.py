@@ -0,0 +1,140 @@
+# rcmp.voices
+#
+# Defines VoiceTable class.
+#
+# Tracks which notes are sounding, per channel and key, from the raw bytes
+# of each message sent.  Overlapping note_on messages for the same key are
+# counted, unmatched note_off messages are ignored, and notes released while
+# the sustain pedal (CC 64) is down remain sounding until the pedal is lifted.
+#
+
+
+class VoiceTable:
+
+    """Fixed 16 x 128 table of sounding notes with per-channel sustain state."""
+
+    def __init__(self):
+        self._counts = bytearray(16 * 128)     # note_on count per channel*128+key
+        self._sustained = bytearray(16 * 128)  # 1 if released while pedal down
+        self._pedals = bytearray(16)           # 1 if sustain pedal down
+        self._active = set()                   # indices of all sounding notes
+
+    def clear(self):
+        self._counts = bytearray(16 * 128)
+        self._sustained = bytearray(16 * 128)
+        self._pedals = bytearray(16)
+        self._active = set()
+
+    def note_on(self, channel, key):
+        index = channel * 128 + key
+        if self._counts[index] < 255:
+            self._counts[index] += 1
+        self._active.add(index)
+
+    def note_off(self, channel, key):
+        index = channel * 128 + key
+        count = self._counts[index]
+        if not count:
+            return
+        count -= 1
+        self._counts[index] = count
+        if not count:
+            if self._pedals[channel]:
+                self._sustained[index] = 1
+            elif not self._sustained[index]:
+                self._active.discard(index)
+
+    def sustain(self, channel, value):
+        """
+        Updates sustain pedal state, lifting the pedal releases held notes.
+        """
+        if value >= 64:
+            self._pedals[channel] = 1
+            return
+        self._pedals[channel] = 0
+        self._release_sustained(channel)
+
+    def _release_sustained(self, channel):
+        low = channel * 128
+        for index in [i for i in self._active if low <= i < low + 128]:
+            self._sustained[index] = 0
+            if not self._counts[index]:
+                self._active.discard(index)
+
+    def all_notes_off(self, channel):
+        """Equivalent of CC 123, notes held by the sustain pedal keep sounding."""
+        low = channel * 128
+        for index in [i for i in self._active if low <= i < low + 128]:
+            self._counts[index] = 0
+            if self._pedals[channel]:
+                self._sustained[index] = 1
+            else:
+                self._active.discard(index)
+
+    def all_sound_off(self, channel):
+        """Equivalent of CC 120, silences the channel regardless of sustain."""
+        low = channel * 128
+        for index in [i for i in self._active if low <= i < low + 128]:
+            self._counts[index] = 0
+            self._sustained[index] = 0
+            self._active.discard(index)
+
+    def update(self, data):
+        """
+        Updates table from the raw bytes of a sent message.
+
+            Parameters:
+                data (bytes): Complete MIDI message, status byte first.
+        """
+        status = data[0]
+        kind = status & 0xF0
+        if kind == 0x90:
+            if data[2]:
+                self.note_on(status & 0x0F, data[1])
+            else:
+                self.note_off(status & 0x0F, data[1])
+        elif kind == 0x80:
+            self.note_off(status & 0x0F, data[1])
+        elif kind == 0xB0:
+            control = data[1]
+            if control == 64:
+                self.sustain(status & 0x0F, data[2])
+            elif control == 123:
+                self.all_notes_off(status & 0x0F)
+            elif control == 120:
+                self.all_sound_off(status & 0x0F)
+
+    def sounding(self):
+        """
+        Returns list of (channel, key) for all sounding notes.
+
+        A key with overlapping note_on messages is listed once per note_on, so
+        that one note_off is sent for each.
+        """
+        acc = []
+        for index in sorted(self._active):
+            pair = divmod(index, 128)
+            acc.extend([pair] * max(1, self._counts[index]))
+        return acc
+
+    def pedals(self):
+        """Returns list of channels with the sustain pedal down."""
+        return [c for c in range(16) if self._pedals[c]]
+
+    def __len__(self):
+        return len(self._active)
+
+    def __str__(self):
+        # Keys held only by the sustain pedal are marked with '*'.
+        acc = f"Voices: {len(self._active)} sounding"
+        channels = {}
+        for index in sorted(self._active):
+            channel, key = divmod(index, 128)
+            flag = "*" if self._sustained[index] and not self._counts[index] else ""
+            channels.setdefault(channel, []).append(f"{key}{flag}")
+        for channel in range(16):
+            if channel in channels or self._pedals[channel]:
+                pedal = " [sustain]" if self._pedals[channel] else ""
+                keys = " ".join(channels.get(channel, []))
+                acc += f"\n    [{channel + 1:2d}]{pedal} {keys}"
+        return acc
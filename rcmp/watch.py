@@ -0,0 +1,272 @@
+# rcmp.watch
+#
+# Defines InotifyWatcher and PollingWatcher classes.
+#
+# A watcher reports changes to the MIDI files in a directory as they
+# happen, so the media-list can be updated one file at a time instead of
+# being cleared and rescanned.  On Linux inotify is used through ctypes and
+# costs nothing while the directory is unchanged; elsewhere the directory is
+# polled.
+#
+# The callback is called from the watcher's thread as callback(kind, name)
+# where kind is one of
+#
+#   CHANGED   name is a new or modified file.
+#   REMOVED   name is a deleted file or directory.
+#   RESCAN    events were lost, name is the watched directory.
+#
+
+import ctypes
+import ctypes.util
+import os
+import os.path as path
+import select
+import struct
+import threading
+import rcmp.log
+
+
+CHANGED = "changed"
+REMOVED = "removed"
+RESCAN = "rescan"
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE |
+         _IN_DELETE | _IN_DELETE_SELF)
+_EVENT = struct.Struct("iIII")    # wd, mask, cookie, len
+
+
+class _Watcher:
+
+    def __init__(self, directory, callback, recursive=False, accept=None):
+        """
+            Parameters:
+                directory (str): Directory to watch.
+                callback (function): Called as callback(kind, name).
+                recursive (bool): If True, also watch nested directories.
+                accept (function): Optional filename filter, only accepted
+                    files are reported.
+        """
+        self.directory = directory
+        self.callback = callback
+        self.recursive = recursive
+        self.accept = accept or (lambda name: True)
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(1.0)
+
+    def _report(self, kind, name):
+        if kind == CHANGED and not self.accept(name):
+            return
+        try:
+            self.callback(kind, name)
+        except Exception as err:
+            # A failing update must not stop the watcher.
+            rcmp.log.error(f"Media watch {kind} '{name}': {err!r}")
+
+    def __str__(self):
+        return f"{type(self).__name__} '{self.directory}'"
+
+
+class InotifyWatcher(_Watcher):
+
+    """Watches a directory with Linux inotify."""
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                cls._libc = libc
+            except (OSError, AttributeError, TypeError):
+                cls._libc = False
+        return bool(cls._libc)
+
+    def __init__(self, directory, callback, recursive=False, accept=None):
+        """
+        Constructs new instance of InotifyWatcher.
+
+        Raises OSError if inotify is not available or directory can not
+        be watched.
+        """
+        super().__init__(directory, callback, recursive, accept)
+        if not self.available():
+            raise OSError("inotify is not available")
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wake_r, self._wake_w = os.pipe()
+        self._paths = {}    # watch descriptor -> directory
+        try:
+            self._add_watch(directory)
+        except OSError:
+            self._close_fds()
+            raise
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), directory)
+        self._paths[wd] = directory
+        if self.recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False):
+                    self._add_watch(entry.path)
+
+    def _added_directory(self, directory):
+        # Watches a new nested directory and reports the files it already
+        # contains, which may have been written before the watch was added.
+        try:
+            self._add_watch(directory)
+        except OSError:
+            return
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                self._report(CHANGED, path.join(root, name))
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        poller.register(self._wake_r, select.POLLIN)
+        try:
+            while not self._closed.is_set():
+                poller.poll()
+                if self._closed.is_set():
+                    break
+                try:
+                    buffer = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._dispatch(buffer)
+        finally:
+            self._close_fds()
+
+    def _dispatch(self, buffer):
+        offset = 0
+        while offset + _EVENT.size <= len(buffer):
+            wd, mask, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = buffer[offset:offset+length].rstrip(b"\0")
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                self._report(RESCAN, self.directory)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_DELETE_SELF:
+                self._paths.pop(wd, None)
+                continue
+            filename = path.join(directory, os.fsdecode(name))
+            if mask & _IN_ISDIR:
+                if not self.recursive:
+                    continue
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._added_directory(filename)
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    self._report(REMOVED, filename)
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                self._report(CHANGED, filename)
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                self._report(REMOVED, filename)
+
+    def close(self):
+        self._closed.set()
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+        super().close()
+        if self._thread is None:
+            self._close_fds()
+
+    def _close_fds(self):
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fd = self._wake_r = self._wake_w = -1
+
+
+class PollingWatcher(_Watcher):
+
+    """Watches a directory by comparing snapshots at a fixed interval."""
+
+    def __init__(self, directory, callback, recursive=False, accept=None, interval=2.0):
+        """
+        Constructs new instance of PollingWatcher.
+
+            Parameters:
+                interval (float): Seconds between snapshots.
+        """
+        super().__init__(directory, callback, recursive, accept)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        # Returns dict filename -> (mtime_ns, size) of accepted files.
+        acc = {}
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if self.accept(name):
+                    filename = path.join(root, name)
+                    try:
+                        st = os.stat(filename)
+                    except OSError:
+                        continue
+                    acc[filename] = (st.st_mtime_ns, st.st_size)
+            if not self.recursive:
+                break
+        return acc
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            snapshot = self._scan()
+            previous = self._snapshot
+            self._snapshot = snapshot
+            for filename, stamp in snapshot.items():
+                if previous.get(filename) != stamp:
+                    self._report(CHANGED, filename)
+            for filename in previous:
+                if filename not in snapshot:
+                    self._report(REMOVED, filename)
+
+
+def create_watcher(directory, callback, recursive=False, accept=None):
+    """
+    Returns started watcher for directory, InotifyWatcher where available,
+    otherwise PollingWatcher.
+    """
+    watcher = None
+    if InotifyWatcher.available():
+        try:
+            watcher = InotifyWatcher(directory, callback, recursive, accept)
+        except OSError as err:
+            rcmp.log.warning(f"inotify unavailable, polling '{directory}': {err}")
+    if watcher is None:
+        watcher = PollingWatcher(directory, callback, recursive, accept)
+    watcher.start()
+    return watcher